@@ -1362,6 +1362,127 @@ required_n_cr = power_analysis.solve_power(effect_size=effect_size_cr, power=0.8
 required_n_ctr, required_n_cr
 
 
+# ## Random Number Management
+# 
+# Every stochastic step in this notebook — bootstrapping, permutation tests, imputation draws, sketch demos and any later simulation or Bayesian sampling — draws from a named stream handed out by one `RandomStreams` object:
+# 
+# - **One root seed.** `ANALYSIS_SEED` seeds a `np.random.SeedSequence`; changing it re-randomises the whole analysis, keeping it fixed reproduces every number.
+# - **Named, independent streams.** `analysis_streams.stream('permutation', 'CTR mean')` returns a fresh `np.random.Generator` whose `SeedSequence` spawn key is derived from the labels. The stream depends only on the root seed and the name, not on how many draws earlier cells made, whether a result came out of the cache, or which thread ran first. `SeedSequence` hashing keeps streams with different spawn keys statistically independent.
+# - **Separate key domains.** Every label becomes a (type tag, word) pair in the spawn key: small non-negative integers are used as-is, text goes through CRC-32, and any other integer gets its own tag. `stream('CTR')` and `stream(zlib.crc32(b'CTR'))` are therefore different streams. Spawned children, integer seeds and child namespaces append reserved tags of their own, so none of them can coincide with a labelled stream.
+# - **Spawned children for parallel work.** `spawn(n, name)` returns `n` child generators via `SeedSequence.spawn`. Work split into chunks uses child `k` for chunk `k`, so serial and threaded runs produce bit-identical results.
+# - **Integer seeds for counter-based generators.** `seed(name)` derives a 64-bit seed for the SplitMix64-based Poisson bootstrap, which keys its weights on row ids rather than on a sequential stream. The seed comes from its own sequence, not from the state of `stream(name)`.
+# 
+# Functions keep accepting `rng=None` (fresh OS entropy), an integer, a `SeedSequence` or a `Generator`, so they still work standalone. `sequence(*names)` returns the `SeedSequence` behind `stream(*names)`; it yields the same draws and is what the cached stages receive (see Result Caching below).
+
+
+# In[ ]:
+
+
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+# Root seed for every random stream in the analysis
+ANALYSIS_SEED = 2019
+
+
+# Tags of the (tag, word) pairs in a spawn key. Labels of different types and the reserved entries for spawned
+# children, integer seeds and child namespaces live in separate domains, so they can never produce the same key.
+_LABEL_UINT32, _LABEL_OTHER_INT, _LABEL_TEXT, _KEY_SPAWN, _KEY_SEED, _KEY_CHILD = range(6)
+
+
+def _stream_key(names):
+    # Stream labels -> spawn-key words: integers that fit in one word are used as-is, other integers (negative
+    # ones, which SeedSequence rejects, or wider ones, which it would split into several words) and any other
+    # label via CRC-32 of their text
+    key = []
+    for name in names:
+        if isinstance(name, (int, np.integer)) and 0 <= name < 2 ** 32:
+            key += [_LABEL_UINT32, int(name)]
+        elif isinstance(name, (int, np.integer)):
+            key += [_LABEL_OTHER_INT, zlib.crc32(str(int(name)).encode('utf-8'))]
+        else:
+            key += [_LABEL_TEXT, zlib.crc32(str(name).encode('utf-8'))]
+    return tuple(key)
+
+
+# Named, reproducible random streams derived from one root SeedSequence. stream(*names) returns a new Generator
+# for the labelled stage; the same labels always give the same stream, independent of call order.
+# spawn(n, *names) returns n independent child generators for chunked or parallel work, and seed(*names) an
+# integer seed for counter-based generators.
+class RandomStreams:
+    def __init__(self, seed=None):
+        self.root = seed if isinstance(seed, np.random.SeedSequence) else np.random.SeedSequence(seed)
+
+    @property
+    def entropy(self):
+        return self.root.entropy
+
+    def sequence(self, *names, reserved=()):
+        return np.random.SeedSequence(self.root.entropy,
+                                      spawn_key=self.root.spawn_key + _stream_key(names) + tuple(reserved),
+                                      pool_size=self.root.pool_size)
+
+    def stream(self, *names):
+        return np.random.Generator(np.random.PCG64(self.sequence(*names)))
+
+    def spawn(self, n, *names):
+        children = self.sequence(*names, reserved=(_KEY_SPAWN, n)).spawn(n)
+        return [np.random.Generator(np.random.PCG64(child)) for child in children]
+
+    def seed(self, *names):
+        return int(self.sequence(*names, reserved=(_KEY_SEED, 0)).generate_state(1, dtype=np.uint64)[0])
+
+    def child(self, *names):
+        # Sub-namespace, e.g. one per experiment
+        return RandomStreams(self.sequence(*names, reserved=(_KEY_CHILD, 0)))
+
+    def __repr__(self):
+        return f'RandomStreams(entropy={self.entropy})'
+
+
+def parallel_bootstrap_means(data, n_bootstrap, streams, name, n_chunks=8, max_workers=None):
+    # Bootstrap means in n_chunks chunks; chunk k always draws from spawned child k, so the result does not depend
+    # on max_workers (1 runs serially) or on thread scheduling
+    values = np.asarray(data, dtype=float)
+    sizes = np.diff(np.linspace(0, n_bootstrap, n_chunks + 1).astype(int))
+    generators = streams.spawn(n_chunks, name)
+
+    def run_chunk(k):
+        indices = generators[k].integers(0, len(values), size=(sizes[k], len(values)))
+        return values[indices].mean(axis=1)
+
+    if max_workers == 1:
+        chunks = [run_chunk(k) for k in range(n_chunks)]
+    else:
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            chunks = list(pool.map(run_chunk, range(n_chunks)))
+    return np.concatenate(chunks)
+
+
+analysis_streams = RandomStreams(ANALYSIS_SEED)
+
+# Same labels -> same draws, regardless of what ran in between
+first = analysis_streams.stream('demo').random(3)
+analysis_streams.stream('other stage').random(1000)
+assert np.array_equal(first, analysis_streams.stream('demo').random(3))
+
+# Labels, spawned children, integer seeds and child namespaces never share a stream
+assert not np.array_equal(analysis_streams.spawn(3, 'parallel_demo')[1].random(3),
+                          analysis_streams.stream('parallel_demo', 1).random(3))
+assert not np.array_equal(analysis_streams.stream('CTR').random(3),
+                          analysis_streams.stream(zlib.crc32(b'CTR')).random(3))
+assert not np.array_equal(analysis_streams.stream(-1).random(3), analysis_streams.stream('-1').random(3))
+assert analysis_streams.seed('demo') != int(analysis_streams.sequence('demo').generate_state(1, dtype=np.uint64)[0])
+assert not np.array_equal(analysis_streams.child('demo').stream('x').random(3),
+                          analysis_streams.stream('demo', 'x').random(3))
+
+# Serial and threaded chunked bootstraps are bit-identical
+serial_means = parallel_bootstrap_means(control_group_cleaned['CTR'], 10000, analysis_streams, 'parallel_demo', max_workers=1)
+threaded_means = parallel_bootstrap_means(control_group_cleaned['CTR'], 10000, analysis_streams, 'parallel_demo', max_workers=4)
+print('Serial == threaded:', np.array_equal(serial_means, threaded_means))
+print('95% CI of Control CTR mean:', np.percentile(serial_means, [2.5, 97.5]).round(3))
+
+
 # ## Bootstrapping
 
 # Bootstrapping is a powerful statistical technique that involves resampling with replacement from an existing dataset to create "new" samples. This method is especially useful when you want to estimate the distribution of a statistic (like the mean, median, or confidence intervals) without making strong assumptions about the underlying population.
@@ -1385,16 +1506,17 @@ required_n_ctr, required_n_cr
 n_bootstrap = 10000
 
 # Function to perform bootstrapping
-def bootstrap_mean(data, n_bootstrap):
+def bootstrap_mean(data, n_bootstrap, rng=None):
+    rng = np.random.default_rng(rng)
     means = []
     for _ in range(n_bootstrap):
-        sample = np.random.choice(data, size=len(data), replace=True)
+        sample = rng.choice(data, size=len(data), replace=True)
         means.append(np.mean(sample))
     return means
 
 # Perform bootstrapping for CTR in Control Group and Test Group
-bootstrap_ctr_control = bootstrap_mean(control_group_cleaned['CTR'], n_bootstrap)
-bootstrap_ctr_test = bootstrap_mean(test_group['CTR'], n_bootstrap)
+bootstrap_ctr_control = bootstrap_mean(control_group_cleaned['CTR'], n_bootstrap, rng=analysis_streams.stream('bootstrap_mean', 'CTR', 'Control'))
+bootstrap_ctr_test = bootstrap_mean(test_group['CTR'], n_bootstrap, rng=analysis_streams.stream('bootstrap_mean', 'CTR', 'Test'))
 
 # Calculate the 95% confidence interval for the bootstrap means
 ctr_control_ci_bootstrap = np.percentile(bootstrap_ctr_control, [2.5, 97.5])
@@ -1466,8 +1588,8 @@ plt.show()
 
 
 # Perform bootstrapping for CR in Control Group and Test Group
-bootstrap_cr_control = bootstrap_mean(control_group_cleaned['CR'], n_bootstrap)
-bootstrap_cr_test = bootstrap_mean(test_group['CR'], n_bootstrap)
+bootstrap_cr_control = bootstrap_mean(control_group_cleaned['CR'], n_bootstrap, rng=analysis_streams.stream('bootstrap_mean', 'CR', 'Control'))
+bootstrap_cr_test = bootstrap_mean(test_group['CR'], n_bootstrap, rng=analysis_streams.stream('bootstrap_mean', 'CR', 'Test'))
 
 # Calculate the 95% confidence interval for the bootstrap means
 cr_control_ci_bootstrap = np.percentile(bootstrap_cr_control, [2.5, 97.5])
@@ -1513,3 +1635,3303 @@ cr_control_ci_bootstrap, cr_test_ci_bootstrap
 # 
 # - There is some overlap in the CR confidence intervals between the **control group** and **test group**, indicating that the difference in CR is not as pronounced as in CTR.
 # - Bootstrapping confirms that the difference in CR between the control and test groups is relatively small.
+
+# ### Data Quality and Outlier Screening
+# 
+# The preliminary check above only counts missing values and prints `describe()`. Before any test is run we also want to know whether a row is logically impossible or an extreme outlier:
+# 
+# - **Impossible rows**: more clicks than impressions, more purchases than clicks, or a reach larger than the number of impressions.
+# - **Robust outlier scores**: a MAD-based modified z-score and Tukey IQR fences per funnel column, which are not pulled around by the outliers themselves the way mean/std are.
+# 
+# All checks work on one float matrix per chunk, so a streamed CSV is screened in a single pass and the per-chunk counts are summed into one quality report. With `repair=True` the repaired chunks are appended to `repaired_path` as they are produced.
+# 
+# The constraint, missing and negative counts are exact whatever the chunk size. The MAD and IQR fences, however, are estimated from each chunk's own median and quartiles unless `fences` is given, so outlier counts depend on `chunksize` and are only exactly additive when the whole file is one chunk. For large files, pass global `fences` (per-column median, MAD, Q1 and Q3, e.g. from quantile sketches) to get chunk-independent outlier flags.
+
+# In[ ]:
+
+
+# Numeric columns shared by the control and test exports
+FUNNEL_COLUMNS = ['Spend [USD]', '# of Impressions', 'Reach', '# of Website Clicks',
+                  '# of Searches', '# of View Content', '# of Add to Cart', '# of Purchase']
+
+# Logical constraints between funnel columns: (check name, column that must be smaller, upper bound column)
+FUNNEL_CONSTRAINTS = [
+    ('reach > impressions', 'Reach', '# of Impressions'),
+    ('clicks > impressions', '# of Website Clicks', '# of Impressions'),
+    ('purchases > clicks', '# of Purchase', '# of Website Clicks'),
+]
+
+
+def chunk_fences(values):
+    # Per-column median, MAD, Q1 and Q3 of a (rows, columns) float matrix
+    median = np.nanmedian(values, axis=0)
+    mad = np.nanmedian(np.abs(values - median), axis=0)
+    q1, q3 = np.nanpercentile(values, [25, 75], axis=0)
+    return median, mad, q1, q3
+
+
+def validate_campaign_chunk(chunk, repair=False, mad_threshold=3.5, iqr_factor=1.5, fences=None):
+    # Pull every funnel column into one float matrix so each check below is a single array operation
+    values = chunk[FUNNEL_COLUMNS].to_numpy(dtype=np.float64, copy=True)
+    lower_idx = [FUNNEL_COLUMNS.index(lower) for _, lower, _ in FUNNEL_CONSTRAINTS]
+    upper_idx = [FUNNEL_COLUMNS.index(upper) for _, _, upper in FUNNEL_CONSTRAINTS]
+
+    # Impossible rows (comparisons against NaN are False, so missing rows are only flagged as missing)
+    missing = np.isnan(values)
+    negative = values < 0
+    violations = values[:, lower_idx] > values[:, upper_idx]
+
+    if repair:
+        # Negative counts become missing, then each offending count is clipped to its upper bound.
+        # Constraints are applied in order, so clicks are clipped before purchases are compared to them.
+        values[negative] = np.nan
+        for lower, upper in zip(lower_idx, upper_idx):
+            values[:, lower] = np.fmin(values[:, lower], values[:, upper])
+
+    # Robust outlier scores per column: MAD modified z-score and Tukey IQR fences (this chunk's unless given)
+    median, mad, q1, q3 = chunk_fences(values) if fences is None else (np.asarray(f, dtype=np.float64) for f in fences)
+    iqr = q3 - q1
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mad_z = np.where(mad > 0, 0.6745 * (values - median) / mad, 0.0)
+    mad_outlier = np.abs(mad_z) > mad_threshold
+    iqr_outlier = (values < q1 - iqr_factor * iqr) | (values > q3 + iqr_factor * iqr)
+
+    # Row-level flags
+    flags = pd.DataFrame(violations, index=chunk.index, columns=[name for name, _, _ in FUNNEL_CONSTRAINTS])
+    flags.insert(0, 'missing', missing.any(axis=1))
+    flags.insert(1, 'negative', negative.any(axis=1))
+    flags['mad_outlier'] = mad_outlier.any(axis=1)
+    flags['iqr_outlier'] = iqr_outlier.any(axis=1)
+    flags['max_abs_mad_z'] = np.nanmax(np.abs(mad_z), axis=1)
+
+    # Column-level counts for this chunk; outlier counts are only additive across chunks with shared fences
+    report = {
+        'rows': len(chunk),
+        'columns': pd.DataFrame({
+            'missing': missing.sum(axis=0),
+            'negative': negative.sum(axis=0),
+            'mad_outliers': mad_outlier.sum(axis=0),
+            'iqr_outliers': iqr_outlier.sum(axis=0),
+        }, index=FUNNEL_COLUMNS),
+        'violations': pd.Series(violations.sum(axis=0), index=flags.columns[2:2 + len(FUNNEL_CONSTRAINTS)]),
+    }
+
+    if repair:
+        chunk = chunk.copy()
+        chunk[FUNNEL_COLUMNS] = values
+    return chunk, flags, report
+
+
+def stream_quality_report(path, chunksize=100_000, repair=False, repaired_path=None, **kwargs):
+    # Screen a campaign export chunk by chunk; only flagged rows and summed counts are kept.
+    # Repaired chunks are appended to repaired_path as they are produced.
+    if repair and repaired_path is None:
+        raise ValueError("repair=True needs a repaired_path to write the repaired rows to")
+    rows = 0
+    column_counts = None
+    violation_counts = None
+    flagged_rows = []
+    for i, chunk in enumerate(pd.read_csv(path, delimiter=';', chunksize=chunksize)):
+        repaired, flags, report = validate_campaign_chunk(chunk, repair=repair, **kwargs)
+        if repair:
+            repaired.to_csv(repaired_path, sep=';', index=False, mode='w' if i == 0 else 'a', header=i == 0)
+        rows += report['rows']
+        column_counts = report['columns'] if column_counts is None else column_counts + report['columns']
+        violation_counts = report['violations'] if violation_counts is None else violation_counts + report['violations']
+        is_flagged = flags.drop(columns='max_abs_mad_z').any(axis=1)
+        flagged_rows.append(flags[is_flagged])
+
+    quality_report = {
+        'rows': rows,
+        'columns': column_counts,
+        'violations': violation_counts,
+    }
+    return pd.concat(flagged_rows), quality_report
+
+# In[ ]:
+
+
+# Run the screening stage on both exports
+control_quality_flags, control_quality_report = stream_quality_report('./control_group.csv')
+test_quality_flags, test_quality_report = stream_quality_report('./test_group.csv')
+
+control_quality_flags, control_quality_report['violations'], test_quality_flags, test_quality_report['violations']
+
+# - No row in either export breaks the funnel constraints. Two control days are flagged: the day with missing funnel counts and one day outside the IQR fences for searches and content views.
+# - Outlier flags are kept for review rather than dropped, because a day-level campaign export can legitimately have spikes.
+
+# ### Missing-Day Imputation
+# 
+# `control_group.dropna()` removes the whole control row for 5.08.2019, although `Spend [USD]` is still recorded for that day. Dropping it leaves 29 control days against 30 test days and throws away the pairing by date.
+# 
+# Instead of dropping, the funnel columns of every campaign are stacked into one `(campaign, day, column)` array on a shared daily calendar and filled in a single vectorized step:
+# 
+# - **`interpolate`**: linear interpolation in time between the nearest observed days (nearest value at the edges).
+# - **`spend_ratio`**: a per-campaign ratio model, `column ≈ Spend × (Σ column / Σ Spend)`, since spend is always observed.
+# 
+# Imputed values are not exact. `imputation_draws` perturbs only the filled cells by the observed day-to-day spread of `column / Spend`. `bootstrap_mean_imputed` then draws one imputation per bootstrap replicate, so the intervals include the uncertainty of the fill.
+
+# In[ ]:
+
+
+def parse_campaign_dates(dates):
+    # Dates are exported as d.mm.yyyy; an explicit format gives one vectorized parse
+    return pd.to_datetime(dates, format='%d.%m.%Y')
+
+
+def campaign_panel(frames, columns=FUNNEL_COLUMNS):
+    # Stack all campaigns into a (campaign, day, column) array on a shared daily calendar
+    combined = pd.concat(frames, ignore_index=True)
+    combined['Date'] = parse_campaign_dates(combined['Date'])
+    campaigns = pd.Index(combined['Campaign Name'].unique())
+    dates = pd.date_range(combined['Date'].min(), combined['Date'].max(), freq='D')
+
+    panel = np.full((len(campaigns), len(dates), len(columns)), np.nan)
+    panel[campaigns.get_indexer(combined['Campaign Name']), dates.get_indexer(combined['Date'])] = \
+        combined[columns].to_numpy(dtype=np.float64)
+    return panel, campaigns, dates
+
+
+def interpolate_panel(panel):
+    # Linear interpolation along the day axis for every campaign and column at once
+    n_days = panel.shape[1]
+    observed = ~np.isnan(panel)
+    day = np.arange(n_days).reshape(1, -1, 1)
+
+    # Index of the previous and next observed day for every cell
+    prev_idx = np.maximum.accumulate(np.where(observed, day, -1), axis=1)
+    next_idx = np.minimum.accumulate(np.where(observed, day, n_days)[:, ::-1], axis=1)[:, ::-1]
+    has_prev = prev_idx >= 0
+    has_next = next_idx < n_days
+
+    prev_val = np.take_along_axis(panel, np.clip(prev_idx, 0, n_days - 1), axis=1)
+    next_val = np.take_along_axis(panel, np.clip(next_idx, 0, n_days - 1), axis=1)
+    # Observed cells keep their value; a unit span there avoids the 0/0 of prev_idx == next_idx == day
+    span = np.where(has_prev & has_next & ~observed, next_idx - prev_idx, 1)
+    interpolated = prev_val + (day - prev_idx) / span * (next_val - prev_val)
+
+    # At the edges fall back to the nearest observed day
+    filled = np.where(has_prev & has_next, interpolated, np.where(has_prev, prev_val, next_val))
+    return np.where(observed, panel, filled)
+
+
+def spend_ratio_fill(panel, columns=FUNNEL_COLUMNS):
+    # Model each funnel column as proportional to spend within its campaign
+    spend = panel[:, :, [columns.index('Spend [USD]')]]
+    observed = ~np.isnan(panel) & ~np.isnan(spend)
+    ratio = np.where(observed, panel, 0).sum(axis=1, keepdims=True) / \
+        np.where(observed, spend, 0).sum(axis=1, keepdims=True)
+    filled = np.where(np.isnan(panel), spend * ratio, panel)
+
+    # Days without spend cannot use the ratio model; interpolate those instead
+    return np.where(np.isnan(filled), interpolate_panel(panel), filled)
+
+
+def impute_missing_days(frames, method='interpolate', columns=FUNNEL_COLUMNS):
+    panel, campaigns, dates = campaign_panel(frames, columns)
+    if method == 'interpolate':
+        filled = interpolate_panel(panel)
+    elif method == 'spend_ratio':
+        filled = spend_ratio_fill(panel, columns)
+    else:
+        raise ValueError(f"Unknown imputation method: {method!r}")
+    imputed_mask = np.isnan(panel) & ~np.isnan(filled)
+
+    # Rebuild one frame per campaign, with parsed dates and a flag for imputed days
+    imputed_frames = {}
+    for c, campaign in enumerate(campaigns):
+        frame = pd.DataFrame(filled[c], columns=columns)
+        frame.insert(0, 'Campaign Name', campaign)
+        frame.insert(1, 'Date', dates)
+        frame['Imputed'] = imputed_mask[c].any(axis=1)
+        imputed_frames[campaign] = frame
+    return imputed_frames, panel, filled
+
+
+def imputation_draws(panel, filled, n_draws=100, columns=FUNNEL_COLUMNS, rng=None):
+    # Multiplicative noise on imputed cells only, scaled by the day-to-day spread of column / Spend
+    rng = np.random.default_rng(rng)
+    spend = panel[:, :, [columns.index('Spend [USD]')]]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        log_ratio = np.log(panel / spend)
+    log_ratio[~np.isfinite(log_ratio)] = np.nan
+    sigma = np.nan_to_num(np.nanstd(log_ratio, axis=1, ddof=1, keepdims=True))
+
+    imputed_mask = np.isnan(panel) & ~np.isnan(filled)
+    noise = np.exp(rng.standard_normal((n_draws,) + panel.shape) * sigma)
+    return np.where(imputed_mask, filled * noise, filled)
+
+
+def bootstrap_mean_imputed(metric_draws, n_bootstrap, rng=None):
+    # metric_draws has shape (n_draws, n_days); each replicate picks one imputation, then resamples days
+    rng = np.random.default_rng(rng)
+    n_draws, n = metric_draws.shape
+    draw = rng.integers(0, n_draws, size=(n_bootstrap, 1))
+    idx = rng.integers(0, n, size=(n_bootstrap, n))
+    return metric_draws[draw, idx].mean(axis=1)
+
+# In[ ]:
+
+
+# Impute the missing control day instead of dropping it
+imputed_groups, funnel_panel, funnel_filled = impute_missing_days([control_group, test_group], method='interpolate')
+control_group_imputed = imputed_groups['Control Campaign']
+test_group_imputed = imputed_groups['Test Campaign']
+
+for group in (control_group_imputed, test_group_imputed):
+    group['CTR'] = group['# of Website Clicks'] / group['# of Impressions'] * 100
+    group['CR'] = group['# of Purchase'] / group['# of Website Clicks'] * 100
+
+control_group_imputed[control_group_imputed['Imputed']]
+
+# In[ ]:
+
+
+# Propagate the imputation uncertainty of the control CTR into its bootstrap interval
+clicks_idx = FUNNEL_COLUMNS.index('# of Website Clicks')
+impressions_idx = FUNNEL_COLUMNS.index('# of Impressions')
+funnel_campaigns = pd.Index(imputed_groups)  # panel order of the campaigns
+control_draws = imputation_draws(funnel_panel, funnel_filled, n_draws=200, rng=analysis_streams.stream('imputation_draws'))
+control_draws = control_draws[:, funnel_campaigns.get_loc('Control Campaign')]
+control_ctr_draws = control_draws[:, :, clicks_idx] / control_draws[:, :, impressions_idx] * 100
+
+bootstrap_ctr_control_imputed = bootstrap_mean_imputed(control_ctr_draws, n_bootstrap, rng=analysis_streams.stream('bootstrap_mean_imputed', 'CTR'))
+ctr_control_ci_imputed = np.percentile(bootstrap_ctr_control_imputed, [2.5, 97.5])
+
+{
+    "CTR Control (dropna)": (control_group_cleaned['CTR'].mean(), tuple(ctr_control_ci_bootstrap)),
+    "CTR Control (imputed)": (control_group_imputed['CTR'].mean(), tuple(ctr_control_ci_imputed)),
+}
+
+# ### Paired, Date-Aligned Analysis
+# 
+# Both campaigns ran on the same 30 days in August 2019, but `ttest_ind` and `mannwhitneyu` treat the two groups as independent samples. Day-level shocks (weekday traffic, platform-wide changes) then stay in the error term. Pairing each control day with the test day of the same date removes that shared variance:
+# 
+# - **Date alignment**: both frames are sorted on the parsed `Date` and merged, so only days present in both campaigns are compared.
+# - **Paired tests**: paired t-test (`ttest_rel`), Wilcoxon signed-rank test on the daily differences, and a vectorized paired bootstrap of the mean difference.
+# - **Paired power**: the paired effect size `d_z = mean(diff) / sd(diff)` drives `TTestPower`, which is compared with the independent-samples requirement from `TTestIndPower`.
+# 
+# The imputed control frame from the previous step is used, so all 30 days keep their pair.
+
+# In[ ]:
+
+
+from scipy.stats import ttest_rel, wilcoxon
+from statsmodels.stats.power import TTestPower
+
+
+def align_campaign_days(control, test, metrics=('CTR', 'CR')):
+    # Sorted merge on parsed dates; days missing from either campaign are left out
+    metrics = list(metrics)
+    left = control.assign(Date=parse_campaign_dates(control['Date']))[['Date'] + metrics].sort_values('Date')
+    right = test.assign(Date=parse_campaign_dates(test['Date']))[['Date'] + metrics].sort_values('Date')
+    aligned = pd.merge(left, right, on='Date', how='inner', sort=True, suffixes=(' (Control)', ' (Test)'))
+    return aligned.dropna().reset_index(drop=True)
+
+
+def paired_tests(control_values, test_values, n_bootstrap=10000, alpha=0.05, rng=None):
+    rng = np.random.default_rng(rng)
+    control_values = np.asarray(control_values, dtype=np.float64)
+    test_values = np.asarray(test_values, dtype=np.float64)
+    diff = test_values - control_values
+    n = len(diff)
+
+    t_stat, t_p_value = ttest_rel(test_values, control_values)
+    w_stat, w_p_value = wilcoxon(diff)
+
+    # Paired bootstrap: resample whole days, so each replicate keeps the control/test pairing
+    idx = rng.integers(0, n, size=(n_bootstrap, n))
+    boot_diff = diff[idx].mean(axis=1)
+    ci_low, ci_high = np.percentile(boot_diff, [100 * alpha / 2, 100 * (1 - alpha / 2)])
+
+    return {
+        'n_pairs': n,
+        'mean_diff': diff.mean(),
+        'sd_diff': diff.std(ddof=1),
+        'effect_size_dz': diff.mean() / diff.std(ddof=1),
+        'paired_t_stat': t_stat,
+        'paired_t_p_value': t_p_value,
+        'wilcoxon_stat': w_stat,
+        'wilcoxon_p_value': w_p_value,
+        'bootstrap_ci': (ci_low, ci_high),
+    }
+
+# In[ ]:
+
+
+# Run the paired mode for CTR and CR on the date-aligned, imputed data
+paired_days = align_campaign_days(control_group_imputed, test_group_imputed)
+paired_results = {
+    metric: paired_tests(paired_days[f'{metric} (Control)'], paired_days[f'{metric} (Test)'],
+                         n_bootstrap=n_bootstrap, alpha=alpha, rng=analysis_streams.sequence('paired_tests', metric))
+    for metric in ['CTR', 'CR']
+}
+paired_results_df = pd.DataFrame(paired_results).T
+
+# Days needed per group for 80% power: paired design vs independent samples (CTR)
+required_n_ctr_paired = TTestPower().solve_power(effect_size=abs(paired_results['CTR']['effect_size_dz']),
+                                                 power=0.80, alpha=alpha)
+
+display(paired_results_df)
+required_n_ctr_paired, required_n_ctr
+
+# - The paired tests agree with the independent ones: the CTR lift is significant (paired t p ≈ 0.0004, Wilcoxon p ≈ 0.0001), and the CR difference is not.
+# - In this export the daily control and test CTRs are barely correlated, so pairing does not shrink the variance. The paired design needs about 17 days for 80% power, roughly the same as the independent design. The paired mode pays off when daily traffic shocks hit both campaigns together, which can be checked here before the test length is planned.
+
+# ### Memory-Lean Metric Derivation
+# 
+# CTR and CR are assigned as new columns onto `control_group_cleaned`, which is itself a `dropna()` result. pandas cannot tell whether that frame is a view or a copy, so the assignment raises `SettingWithCopyWarning`. Each `/` and `* 100` also allocates a full float64 temporary.
+# 
+# `DerivedMetrics` keeps derived ratios outside the source frame:
+# 
+# - Metrics are declared once in `METRIC_DEFINITIONS` as `(numerator, denominator, scale)`.
+# - A metric is computed only the first time it is requested. `np.divide` writes straight into a preallocated buffer of the configured dtype (`float32` halves the footprint), and the scale is applied in place.
+# - Callers receive read-only views of the buffers, so nothing downstream can silently modify or copy them. The source frame is never touched.
+
+# In[ ]:
+
+
+# Derived ratio metrics: name -> (numerator column, denominator column, scale)
+METRIC_DEFINITIONS = {
+    'CTR': ('# of Website Clicks', '# of Impressions', 100.0),
+    'CR': ('# of Purchase', '# of Website Clicks', 100.0),
+    'Cost per Reach': ('Spend [USD]', 'Reach', 1.0),
+    'CPC': ('Spend [USD]', '# of Website Clicks', 1.0),
+    'CPA': ('Spend [USD]', '# of Purchase', 1.0),
+    'CPM': ('Spend [USD]', '# of Impressions', 1000.0),
+    'Cost per Add to Cart': ('Spend [USD]', '# of Add to Cart', 1.0),
+}
+
+
+class DerivedMetrics:
+    def __init__(self, frame, definitions=None, dtype=np.float64):
+        self.frame = frame
+        self.definitions = dict(METRIC_DEFINITIONS if definitions is None else definitions)
+        self.dtype = np.dtype(dtype)
+        self._buffers = {}
+
+    def __getitem__(self, name):
+        # Materialise the metric on first access only
+        if name not in self._buffers:
+            self._buffers[name] = self._derive(name)
+        view = self._buffers[name].view()
+        view.flags.writeable = False
+        return view
+
+    def _derive(self, name):
+        numerator, denominator, scale = self.definitions[name]
+        num = self.frame[numerator].to_numpy()
+        den = self.frame[denominator].to_numpy()
+
+        # Divide straight into the preallocated buffer; zero denominators stay NaN
+        out = np.full(len(num), np.nan, dtype=self.dtype)
+        np.divide(num, den, out=out, where=den != 0)
+        if scale != 1.0:
+            np.multiply(out, scale, out=out)
+        return out
+
+    def derive_all(self, names=None):
+        return {name: self[name] for name in (self.definitions if names is None else names)}
+
+    @property
+    def materialised(self):
+        return list(self._buffers)
+
+    @property
+    def nbytes(self):
+        return sum(buffer.nbytes for buffer in self._buffers.values())
+
+# In[ ]:
+
+
+# Derive CTR and CR for both imputed groups in float32; the cost metrics are declared but never materialised
+control_metrics = DerivedMetrics(control_group_imputed, dtype=np.float32)
+test_metrics = DerivedMetrics(test_group_imputed, dtype=np.float32)
+
+control_ctr, control_cr = control_metrics['CTR'], control_metrics['CR']
+test_ctr, test_cr = test_metrics['CTR'], test_metrics['CR']
+
+control_metrics.materialised, control_metrics.nbytes, float(control_ctr.mean()), float(test_ctr.mean())
+
+# ### Compact Result Store
+# 
+# So far results are spread over loose tuples (`ctr_t_stat, ctr_p_value`), dicts of CIs, the `effect_sizes` list and small DataFrames. That is fine for one experiment, but each of those values is a separate Python object, and thousands of experiments add up to millions of them.
+# 
+# `ResultStore` keeps one row per `(experiment, metric, test)` in contiguous NumPy columns:
+# 
+# - Key fields are stored as `int32` codes with one label list per field, and values as `float64` columns that grow by doubling.
+# - `filter` combines label matches with any boolean expression over the columns, e.g. `store['p_value'] < 0.05`, without building per-row objects.
+# - `to_records` returns a packed structured array. `to_frame` exposes the key codes as pandas categoricals.
+# - `to_arrow` / `to_parquet` wrap the columns as Arrow arrays without copying and encode the keys as dictionary arrays. This path needs the optional `pyarrow` package.
+
+# In[ ]:
+
+
+class ResultStore:
+    KEY_FIELDS = ('experiment', 'metric', 'test')
+    VALUE_FIELDS = ('statistic', 'p_value', 'effect_size', 'ci_low', 'ci_high', 'power')
+
+    def __init__(self, capacity=1024):
+        self._size = 0
+        self._labels = {field: [] for field in self.KEY_FIELDS}
+        self._label_codes = {field: {} for field in self.KEY_FIELDS}
+        self._columns = {field: np.empty(capacity, dtype=np.int32) for field in self.KEY_FIELDS}
+        self._columns.update({field: np.full(capacity, np.nan) for field in self.VALUE_FIELDS})
+
+    def __len__(self):
+        return self._size
+
+    def __getitem__(self, field):
+        # Views of the filled part of each column
+        return self._columns[field][:self._size]
+
+    def _codes(self, field, labels, n):
+        lookup = self._label_codes[field]
+        for label in np.unique(np.asarray(labels, dtype=object)):
+            if label not in lookup:
+                lookup[label] = len(self._labels[field])
+                self._labels[field].append(label)
+        if np.ndim(labels) == 0:
+            return np.full(n, lookup[labels], dtype=np.int32)
+        return np.array([lookup[label] for label in labels], dtype=np.int32)
+
+    def _reserve(self, n):
+        capacity = len(self._columns['p_value'])
+        if self._size + n <= capacity:
+            return
+        while capacity < self._size + n:
+            capacity *= 2
+        for field, column in self._columns.items():
+            grown = np.empty(capacity, dtype=column.dtype) if field in self.KEY_FIELDS else np.full(capacity, np.nan)
+            grown[:self._size] = column[:self._size]
+            self._columns[field] = grown
+
+    def extend(self, experiment, metric, test, **values):
+        # Bulk append; keys may be single labels or one label per row, values are scalars or arrays
+        unknown = set(values) - set(self.VALUE_FIELDS)
+        if unknown:
+            raise KeyError(f"Unknown result fields: {sorted(unknown)}")
+        sizes = [np.size(v) for v in (experiment, metric, test, *values.values()) if np.ndim(v) > 0]
+        n = max(sizes, default=1)
+        self._reserve(n)
+        rows = slice(self._size, self._size + n)
+        for field, labels in zip(self.KEY_FIELDS, (experiment, metric, test)):
+            self._columns[field][rows] = self._codes(field, labels, n)
+        for field, value in values.items():
+            self._columns[field][rows] = value
+        self._size += n
+        return self
+
+    def append(self, experiment, metric, test, **values):
+        return self.extend(experiment, metric, test, **values)
+
+    def filter(self, where=None, **labels):
+        # Boolean mask from label matches (single label or list) combined with an optional column expression
+        mask = np.ones(self._size, dtype=bool) if where is None else np.asarray(where, dtype=bool).copy()
+        for field, wanted in labels.items():
+            wanted = [wanted] if isinstance(wanted, str) else list(wanted)
+            codes = [self._label_codes[field][w] for w in wanted if w in self._label_codes[field]]
+            mask &= np.isin(self[field], codes)
+        subset = ResultStore(capacity=max(int(mask.sum()), 1))
+        subset._labels = {field: list(labels_) for field, labels_ in self._labels.items()}
+        subset._label_codes = {field: dict(codes_) for field, codes_ in self._label_codes.items()}
+        for field in self._columns:
+            subset._columns[field][:mask.sum()] = self[field][mask]
+        subset._size = int(mask.sum())
+        return subset
+
+    def to_records(self):
+        dtype = [(field, np.int32) for field in self.KEY_FIELDS] + [(field, np.float64) for field in self.VALUE_FIELDS]
+        records = np.empty(self._size, dtype=dtype)
+        for field in self._columns:
+            records[field] = self[field]
+        return records
+
+    def to_frame(self):
+        frame = {field: pd.Categorical.from_codes(self[field], categories=self._labels[field])
+                 for field in self.KEY_FIELDS}
+        frame.update({field: self[field] for field in self.VALUE_FIELDS})
+        return pd.DataFrame(frame)
+
+    def to_arrow(self):
+        try:
+            import pyarrow as pa
+        except ImportError as exc:
+            raise ImportError("pyarrow is required for Arrow/Parquet export of results") from exc
+        # Numeric columns and key codes are wrapped without copying; keys become dictionary arrays
+        arrays = [pa.DictionaryArray.from_arrays(pa.array(self[field]), pa.array(self._labels[field], type=pa.string()))
+                  for field in self.KEY_FIELDS]
+        arrays += [pa.array(self[field]) for field in self.VALUE_FIELDS]
+        return pa.table(arrays, names=list(self.KEY_FIELDS + self.VALUE_FIELDS))
+
+    def to_parquet(self, path):
+        import pyarrow.parquet as pq
+        pq.write_table(self.to_arrow(), path)
+
+# In[ ]:
+
+
+# Collect the results computed so far into one store
+experiment_name = 'ad_campaign_2019_08'
+result_store = ResultStore()
+result_store.append(experiment_name, 'CTR', 'welch_t', statistic=ctr_t_stat, p_value=ctr_p_value,
+                    effect_size=cohen_d_ctr, power=power_ctr)
+result_store.append(experiment_name, 'CR', 'mann_whitney_u', statistic=mannwhitney_cr_stat, p_value=mannwhitney_cr_p_value,
+                    effect_size=cliffs_delta_cr, power=power_cr)
+for metric, paired in paired_results.items():
+    result_store.extend(experiment_name, metric, ['paired_t', 'wilcoxon'],
+                        statistic=[paired['paired_t_stat'], paired['wilcoxon_stat']],
+                        p_value=[paired['paired_t_p_value'], paired['wilcoxon_p_value']],
+                        effect_size=paired['effect_size_dz'],
+                        ci_low=paired['bootstrap_ci'][0], ci_high=paired['bootstrap_ci'][1])
+
+significant_results = result_store.filter(where=result_store['p_value'] < alpha)
+significant_results.to_frame()
+
+# ### Permutation Test Engine
+# 
+# CR fails the Shapiro–Wilk check, so the script falls back to Mann–Whitney, which tests a shift in distribution rather than the difference we report. A permutation test compares the statistic we actually care about (mean, median, or a ratio metric such as Σ purchases / Σ clicks) and makes no distributional assumption.
+# 
+# How the engine works:
+# 
+# - **Batched shuffles**: each batch is an index matrix of shape `(batch_size, n)` from `Generator.permuted`. The statistic is then computed for every permutation with array operations. For means and ratios only the test-group sums are gathered, and the control side comes from the totals.
+# - **Exact mode**: when the number of distinct group assignments is at most `max_permutations`, all of them are enumerated.
+# - **Sequential stopping**: after each batch a Clopper–Pearson interval is computed for the Monte Carlo p-value. Sampling stops as soon as the whole interval lies on one side of `alpha`. Clearly significant or clearly null comparisons therefore stop after one or two batches.
+
+# In[ ]:
+
+
+from itertools import combinations
+from math import comb
+from scipy.stats import beta as beta_dist
+
+
+def _group_statistic(pooled, test_idx, statistic, totals):
+    # Statistic (test minus control) for every row of the index matrix test_idx
+    if statistic == 'mean':
+        n_test = test_idx.shape[1]
+        test_sum = pooled[test_idx].sum(axis=1)
+        return test_sum / n_test - (totals - test_sum) / (len(pooled) - n_test)
+    if statistic == 'ratio':
+        test_sums = pooled[test_idx].sum(axis=1)
+        control_sums = totals - test_sums
+        return test_sums[:, 0] / test_sums[:, 1] - control_sums[:, 0] / control_sums[:, 1]
+    if statistic == 'median':
+        control_mask = np.ones((len(test_idx), len(pooled)), dtype=bool)
+        np.put_along_axis(control_mask, test_idx, False, axis=1)
+        control_values = pooled[np.nonzero(control_mask)[1]].reshape(len(test_idx), -1)
+        return np.median(pooled[test_idx], axis=1) - np.median(control_values, axis=1)
+    raise ValueError(f"Unknown permutation statistic: {statistic!r}")
+
+
+def _exceeds(perm_stats, observed, alternative):
+    if alternative == 'two-sided':
+        return np.abs(perm_stats) >= np.abs(observed)
+    if alternative == 'greater':
+        return perm_stats >= observed
+    if alternative == 'less':
+        return perm_stats <= observed
+    raise ValueError(f"Unknown alternative: {alternative!r}")
+
+
+def permutation_test(control, test, statistic='mean', alternative='two-sided', alpha=0.05,
+                     batch_size=1000, max_permutations=100_000, confidence=0.999, rng=None):
+    # For statistic='ratio' both inputs are (n, 2) arrays of (numerator, denominator) rows
+    rng = np.random.default_rng(rng)
+    control = np.asarray(control, dtype=np.float64)
+    test = np.asarray(test, dtype=np.float64)
+    pooled = np.concatenate([control, test])
+    n, n_test = len(pooled), len(test)
+    totals = pooled.sum(axis=0)
+
+    observed = _group_statistic(pooled, np.arange(len(control), n)[None, :], statistic, totals)[0]
+
+    # Exact mode: enumerate every assignment of rows to the test group
+    if comb(n, n_test) <= max_permutations:
+        test_idx = np.array(list(combinations(range(n), n_test)))
+        perm_stats = _group_statistic(pooled, test_idx, statistic, totals)
+        exceed = _exceeds(perm_stats, observed, alternative).sum()
+        return {'statistic': observed, 'p_value': exceed / len(test_idx), 'n_permutations': len(test_idx),
+                'exact': True, 'stopped_early': False}
+
+    exceed = 0
+    done = 0
+    tail = (1 - confidence) / 2
+    base = np.broadcast_to(np.arange(n), (batch_size, n))
+    while done < max_permutations:
+        size = min(batch_size, max_permutations - done)
+        test_idx = rng.permuted(base[:size], axis=1)[:, :n_test]
+        exceed += _exceeds(_group_statistic(pooled, test_idx, statistic, totals), observed, alternative).sum()
+        done += size
+
+        # Clopper-Pearson interval for the Monte Carlo p-value; stop once it clears alpha
+        low = beta_dist.ppf(tail, exceed, done - exceed + 1) if exceed > 0 else 0.0
+        high = beta_dist.ppf(1 - tail, exceed + 1, done - exceed) if exceed < done else 1.0
+        if high < alpha or low > alpha:
+            break
+
+    return {'statistic': observed, 'p_value': (exceed + 1) / (done + 1), 'n_permutations': done,
+            'exact': False, 'stopped_early': done < max_permutations}
+
+# In[ ]:
+
+
+# Permutation tests for CR on the imputed daily data: difference in means, medians and the pooled ratio
+cr_ratio_control = control_group_imputed[['# of Purchase', '# of Website Clicks']].to_numpy()
+cr_ratio_test = test_group_imputed[['# of Purchase', '# of Website Clicks']].to_numpy()
+
+permutation_results = pd.DataFrame({
+    'CR mean': permutation_test(control_cr, test_cr, statistic='mean', rng=analysis_streams.sequence('permutation', 'CR mean')),
+    'CR median': permutation_test(control_cr, test_cr, statistic='median', rng=analysis_streams.sequence('permutation', 'CR median')),
+    'CR ratio (Σ purchases / Σ clicks)': permutation_test(cr_ratio_control, cr_ratio_test, statistic='ratio', rng=analysis_streams.sequence('permutation', 'CR ratio')),
+    'CTR mean': permutation_test(control_ctr, test_ctr, statistic='mean', rng=analysis_streams.sequence('permutation', 'CTR mean')),
+}).T
+
+permutation_results
+
+# ### BCa and Studentized Bootstrap Intervals
+# 
+# The bootstrap intervals above are plain percentiles of 10,000 resampled means. For a skewed metric such as CR they are biased and under-cover. Two better-calibrated intervals are added:
+# 
+# - **BCa (bias-corrected and accelerated)**: shifts the percentile positions by the bias-correction `z0` and the acceleration `a`. The jackknife values behind `a` come from running sums in closed form, `(S - x_i) / (n - 1)` for a mean and `(ΣN - n_i) / (ΣD - d_i)` for a ratio, instead of re-evaluating the statistic `n` times.
+# - **Studentized (bootstrap-t)**: each resample is standardised by its own standard error, which is computed from the same resampled sums (sum, sum of squares and cross products for ratios).
+# 
+# Resamples are drawn as index matrices in batches. All requested order statistics are read from a single `np.partition` call. Because both intervals are second-order accurate, a few thousand resamples give the accuracy that percentile intervals need 10,000 for.
+
+# In[ ]:
+
+
+from scipy.stats import norm
+
+
+def _partition_quantiles(samples, quantiles):
+    # Linear-interpolated quantiles from one np.partition call over all needed order statistics
+    positions = np.clip(np.asarray(quantiles), 0, 1) * (len(samples) - 1)
+    lower = np.floor(positions).astype(int)
+    upper = np.ceil(positions).astype(int)
+    ordered = np.partition(samples, np.unique(np.concatenate([lower, upper])))
+    return ordered[lower] + (positions - lower) * (ordered[upper] - ordered[lower])
+
+
+def _sample_sums(values, idx=None):
+    # Sums needed for the estimate and its standard error, over the full sample or each resample row of idx
+    rows = values if idx is None else values[idx]
+    axis = 0 if idx is None else 1
+    if values.ndim == 1:
+        return {'s': rows.sum(axis=axis), 'ss': (rows ** 2).sum(axis=axis)}
+    num, den = rows[..., 0], rows[..., 1]
+    return {'num': num.sum(axis=axis), 'den': den.sum(axis=axis), 'nn': (num ** 2).sum(axis=axis),
+            'dd': (den ** 2).sum(axis=axis), 'nd': (num * den).sum(axis=axis)}
+
+
+def _estimate_and_se(sums, n):
+    if 's' in sums:
+        estimate = sums['s'] / n
+        var = np.maximum(sums['ss'] - sums['s'] ** 2 / n, 0) / (n - 1)
+        return estimate, np.sqrt(var / n)
+    # Ratio of sums with a delta-method standard error
+    estimate = sums['num'] / sums['den']
+    resid_ss = sums['nn'] - 2 * estimate * sums['nd'] + estimate ** 2 * sums['dd']
+    se = np.sqrt(np.maximum(resid_ss, 0) / (n - 1) / n) / (sums['den'] / n)
+    return estimate, se
+
+
+def _jackknife(values):
+    # Leave-one-out estimates from running sums, no re-evaluation per row
+    n = len(values)
+    if values.ndim == 1:
+        return (values.sum() - values) / (n - 1)
+    totals = values.sum(axis=0)
+    return (totals[0] - values[:, 0]) / (totals[1] - values[:, 1])
+
+
+def bootstrap_ci(data, method='bca', n_bootstrap=2000, alpha=0.05, batch_size=1000, rng=None):
+    # data is a 1-D sample (mean) or an (n, 2) array of (numerator, denominator) rows (ratio of sums)
+    rng = np.random.default_rng(rng)
+    values = np.asarray(data, dtype=np.float64)
+    n = len(values)
+    estimate, se = _estimate_and_se(_sample_sums(values), n)
+
+    boot_estimates = np.empty(n_bootstrap)
+    boot_t = np.empty(n_bootstrap)
+    for start in range(0, n_bootstrap, batch_size):
+        stop = min(start + batch_size, n_bootstrap)
+        idx = rng.integers(0, n, size=(stop - start, n))
+        boot_est, boot_se = _estimate_and_se(_sample_sums(values, idx), n)
+        boot_estimates[start:stop] = boot_est
+        with np.errstate(divide='ignore', invalid='ignore'):
+            boot_t[start:stop] = (boot_est - estimate) / boot_se
+
+    result = {'estimate': estimate, 'method': method, 'n_bootstrap': n_bootstrap}
+    if method == 'percentile':
+        result['ci'] = tuple(_partition_quantiles(boot_estimates, [alpha / 2, 1 - alpha / 2]))
+    elif method == 'bca':
+        below = (boot_estimates < estimate).mean() + 0.5 * (boot_estimates == estimate).mean()
+        z0 = norm.ppf(np.clip(below, 1 / n_bootstrap, 1 - 1 / n_bootstrap))
+        jack = _jackknife(values)
+        dev = jack.mean() - jack
+        acceleration = (dev ** 3).sum() / (6 * ((dev ** 2).sum()) ** 1.5)
+        z = norm.ppf([alpha / 2, 1 - alpha / 2])
+        adjusted = norm.cdf(z0 + (z0 + z) / (1 - acceleration * (z0 + z)))
+        result.update(ci=tuple(_partition_quantiles(boot_estimates, adjusted)),
+                      bias_correction=z0, acceleration=acceleration)
+    elif method == 'studentized':
+        t_quantiles = _partition_quantiles(boot_t[np.isfinite(boot_t)], [alpha / 2, 1 - alpha / 2])
+        result.update(ci=(estimate - t_quantiles[1] * se, estimate - t_quantiles[0] * se), se=se)
+    else:
+        raise ValueError(f"Unknown bootstrap interval method: {method!r}")
+    return result
+
+# In[ ]:
+
+
+# CR intervals with 2,000 resamples: percentile vs BCa vs studentized, for the daily mean and the pooled ratio
+cr_interval_comparison = pd.DataFrame({
+    f'{group} {method}': bootstrap_ci(values, method=method, n_bootstrap=2000, rng=analysis_streams.sequence('bootstrap_ci', group, method))['ci']
+    for group, values in [('Control CR', control_cr), ('Test CR', test_cr),
+                          ('Control CR ratio', cr_ratio_control), ('Test CR ratio', cr_ratio_test)]
+    for method in ['percentile', 'bca', 'studentized']
+}, index=['CI Lower', 'CI Upper']).T
+
+cr_interval_comparison
+
+# ### Poisson Bootstrap for Streaming and Distributed Data
+# 
+# `bootstrap_mean` needs the whole column in memory to draw resamples with `rng.choice`. The Poisson bootstrap replaces "draw n rows with replacement" with "give every row an independent Poisson(1) weight per replicate". Asymptotically this is the same, and it never needs the full sample:
+# 
+# - **Counter-based weights**: the weight of row `r` in replicate `b` is a pure function of `(seed, r, b)`. A SplitMix64 hash turns the triple into a uniform number, and a Poisson(1) inverse-CDF lookup turns that into a weight. No generator state is carried between chunks, so any worker can regenerate exactly the weights of the rows it owns.
+# - **Accumulators**: each replicate keeps only weighted sums (Σw, Σw·x, and Σw·d for ratio metrics). A chunk of rows updates all replicates with one matrix product.
+# - **Merging**: the sums from different chunks, files or workers simply add. A streamed or distributed run therefore gives exactly the same replicates as a single in-memory pass.
+# 
+# Row ids come from a CRC of the partition id combined with the row position in the file, so they are stable across runs and workers. The partition id defaults to the normalised file path, so same-named files in different directories get different weights. Pass an explicit `partition_id` when the same data can be read from different locations.
+
+# In[ ]:
+
+
+import os
+from scipy.stats import poisson
+
+# Inverse CDF table of Poisson(1); weights above 20 have probability < 1e-19
+_POISSON1_CDF = poisson.cdf(np.arange(21), 1.0)
+_SPLITMIX_GAMMA = np.uint64(0x9E3779B97F4A7C15)
+
+
+def _splitmix64(x):
+    # SplitMix64 finaliser, vectorized over uint64 arrays; the wrap-around is intended, so numpy's
+    # overflow warning for scalar uint64 arithmetic is silenced
+    with np.errstate(over='ignore'):
+        x = x + _SPLITMIX_GAMMA
+        x = (x ^ (x >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+        x = (x ^ (x >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+        return x ^ (x >> np.uint64(31))
+
+
+def poisson_weights(row_ids, n_replicates, seed=0):
+    # (rows, replicates) Poisson(1) weights that depend only on (seed, row id, replicate)
+    row_keys = _splitmix64(np.asarray(row_ids, dtype=np.uint64) ^ _splitmix64(np.uint64(seed)))
+    with np.errstate(over='ignore'):
+        counters = row_keys[:, None] + np.arange(n_replicates, dtype=np.uint64) * _SPLITMIX_GAMMA
+    uniforms = (_splitmix64(counters) >> np.uint64(11)) * (1.0 / (1 << 53))
+    return np.searchsorted(_POISSON1_CDF, uniforms, side='right').astype(np.float64)
+
+
+def source_row_ids(source, positions):
+    # Stable row ids: CRC32 of the partition id (a normalised path or caller-chosen name) in the high bits,
+    # row position in the low bits
+    return (np.uint64(zlib.crc32(os.path.normpath(str(source)).encode())) << np.uint64(32)) | \
+        np.asarray(positions, dtype=np.uint64)
+
+
+class PoissonBootstrap:
+    def __init__(self, n_replicates=2000, seed=0, ratio=False, block_rows=4096):
+        self.n_replicates = n_replicates
+        self.seed = seed
+        self.ratio = ratio
+        self.block_rows = block_rows
+        self.n_rows = 0
+        self.totals = np.zeros(2)  # unweighted Σx, Σd for the point estimate
+        self.weight_sum = np.zeros(n_replicates)
+        self.value_sum = np.zeros(n_replicates)
+        self.denominator_sum = np.zeros(n_replicates)
+
+    def update(self, row_ids, values, denominators=None):
+        values = np.asarray(values, dtype=np.float64)
+        denominators = np.ones_like(values) if denominators is None else np.asarray(denominators, dtype=np.float64)
+        row_ids = np.asarray(row_ids, dtype=np.uint64)
+
+        # Weights are generated block by block, so memory stays at block_rows x n_replicates
+        for start in range(0, len(values), self.block_rows):
+            block = slice(start, start + self.block_rows)
+            weights = poisson_weights(row_ids[block], self.n_replicates, self.seed)
+            x, d = values[block], denominators[block]
+            self.weight_sum += weights.sum(axis=0)
+            self.value_sum += x @ weights
+            self.denominator_sum += d @ weights
+
+        self.n_rows += len(values)
+        self.totals += [values.sum(), denominators.sum()]
+        return self
+
+    def merge(self, other):
+        if (other.n_replicates, other.seed, other.ratio) != (self.n_replicates, self.seed, self.ratio):
+            raise ValueError("Only Poisson bootstraps with the same replicates, seed and metric type can be merged")
+        self.n_rows += other.n_rows
+        self.totals += other.totals
+        self.weight_sum += other.weight_sum
+        self.value_sum += other.value_sum
+        self.denominator_sum += other.denominator_sum
+        return self
+
+    @property
+    def estimate(self):
+        return self.totals[0] / (self.totals[1] if self.ratio else self.n_rows)
+
+    @property
+    def replicates(self):
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return self.value_sum / (self.denominator_sum if self.ratio else self.weight_sum)
+
+    def ci(self, alpha=0.05):
+        replicates = self.replicates
+        return tuple(np.percentile(replicates[np.isfinite(replicates)], [100 * alpha / 2, 100 * (1 - alpha / 2)]))
+
+
+def poisson_bootstrap_csv(path, numerator, denominator=None, scale=1.0, n_replicates=2000, seed=0, chunksize=100_000,
+                          partition_id=None):
+    # One streaming pass over a campaign export; no resample or full column is ever held in memory
+    boot = PoissonBootstrap(n_replicates=n_replicates, seed=seed, ratio=denominator is not None)
+    columns = [numerator] if denominator is None else [numerator, denominator]
+    for chunk in pd.read_csv(path, delimiter=';', chunksize=chunksize):
+        chunk = chunk.dropna(subset=columns)
+        values = chunk[numerator].to_numpy(dtype=np.float64) * scale
+        denominators = None if denominator is None else chunk[denominator].to_numpy(dtype=np.float64)
+        boot.update(source_row_ids(path if partition_id is None else partition_id, chunk.index.to_numpy()),
+                    values, denominators)
+    return boot
+
+# In[ ]:
+
+
+# Pooled CTR (Σ clicks / Σ impressions, in %) streamed from each export in small chunks
+poisson_ctr_control = poisson_bootstrap_csv('./control_group.csv', '# of Website Clicks', '# of Impressions',
+                                            scale=100, seed=analysis_streams.seed('poisson_bootstrap'), chunksize=10)
+poisson_ctr_test = poisson_bootstrap_csv('./test_group.csv', '# of Website Clicks', '# of Impressions',
+                                         scale=100, seed=analysis_streams.seed('poisson_bootstrap'), chunksize=10)
+
+# Two "workers" each own half of the control rows; merging their sums reproduces the single pass exactly
+control_rows = control_group.dropna(subset=['# of Website Clicks', '# of Impressions'])
+worker_parts = []
+for part in np.array_split(control_rows.index.to_numpy(), 2):
+    rows = control_rows.loc[part]
+    worker_parts.append(PoissonBootstrap(seed=analysis_streams.seed('poisson_bootstrap'), ratio=True).update(
+        source_row_ids('./control_group.csv', part),
+        rows['# of Website Clicks'].to_numpy() * 100, rows['# of Impressions'].to_numpy()))
+merged_control = worker_parts[0].merge(worker_parts[1])
+
+{
+    "Control pooled CTR": (poisson_ctr_control.estimate, poisson_ctr_control.ci()),
+    "Test pooled CTR": (poisson_ctr_test.estimate, poisson_ctr_test.ci()),
+    "Merged workers match single pass": bool(np.allclose(merged_control.replicates, poisson_ctr_control.replicates)),
+}
+
+# ### Two-Sample Bootstrap of the Difference and Effect Sizes
+# 
+# `bootstrap_ctr_control` and `bootstrap_ctr_test` are bootstrapped separately, and the groups are then compared by eye through overlapping intervals. Overlapping 95% intervals do not imply a non-significant difference, and running two independent bootstraps per metric doubles the work. The two-sample bootstrap resamples both groups in every replicate and reports intervals for the comparison itself:
+# 
+# - **Difference** `mean(test) - mean(control)` and **relative lift** `mean(test) / mean(control) - 1`
+# - **Cohen's d** and **Cliff's delta**, with the same orientation as `cohen_d` and `cliffs_delta_manual` above (control relative to test)
+# 
+# Each batch of resamples is stored as count matrices: how often each day was drawn in each replicate. All four statistics come from the same counts. Means and variances are matrix products with `x` and `x²`. Cliff's delta is `Cx · sign(x_i - y_j) · Cyᵀ`, which reuses one precomputed sign matrix instead of re-comparing all pairs per replicate.
+
+# In[ ]:
+
+
+def _resample_counts(rng, n, size):
+    # (size, n) matrix of how often each row is drawn in each replicate
+    idx = rng.integers(0, n, size=(size, n)) + np.arange(size)[:, None] * n
+    return np.bincount(idx.ravel(), minlength=size * n).reshape(size, n).astype(np.float64)
+
+
+def two_sample_bootstrap(control, test, n_bootstrap=2000, alpha=0.05, batch_size=500, rng=None):
+    rng = np.random.default_rng(rng)
+    x = np.asarray(control, dtype=np.float64)
+    y = np.asarray(test, dtype=np.float64)
+    nx, ny = len(x), len(y)
+    signs = np.sign(x[:, None] - y[None, :])
+
+    def statistics(cx, cy):
+        mean_x, mean_y = cx @ x / nx, cy @ y / ny
+        var_x = (cx @ x ** 2 - nx * mean_x ** 2) / (nx - 1)
+        var_y = (cy @ y ** 2 - ny * mean_y ** 2) / (ny - 1)
+        pooled_std = np.sqrt(((nx - 1) * var_x + (ny - 1) * var_y) / (nx + ny - 2))
+        return {
+            'difference': mean_y - mean_x,
+            'relative_lift': mean_y / mean_x - 1,
+            'cohens_d': (mean_x - mean_y) / pooled_std,
+            'cliffs_delta': ((cx @ signs) * cy).sum(axis=1) / (nx * ny),
+        }
+
+    # Point estimates are the same formulas with every row drawn once
+    observed = statistics(np.ones((1, nx)), np.ones((1, ny)))
+
+    replicates = {name: np.empty(n_bootstrap) for name in observed}
+    for start in range(0, n_bootstrap, batch_size):
+        stop = min(start + batch_size, n_bootstrap)
+        batch = statistics(_resample_counts(rng, nx, stop - start), _resample_counts(rng, ny, stop - start))
+        for name, values in batch.items():
+            replicates[name][start:stop] = values
+
+    bounds = np.array([_partition_quantiles(values, [alpha / 2, 1 - alpha / 2]) for values in replicates.values()])
+    summary = pd.DataFrame({
+        'estimate': [observed[name][0] for name in replicates],
+        'ci_low': bounds[:, 0],
+        'ci_high': bounds[:, 1],
+    }, index=list(replicates))
+    return summary, replicates
+
+# In[ ]:
+
+
+# One bootstrap run per metric gives every interval of the comparison
+ctr_two_sample, ctr_two_sample_replicates = two_sample_bootstrap(control_ctr, test_ctr, n_bootstrap=n_bootstrap, rng=analysis_streams.sequence('two_sample_bootstrap', 'CTR'))
+cr_two_sample, cr_two_sample_replicates = two_sample_bootstrap(control_cr, test_cr, n_bootstrap=n_bootstrap, rng=analysis_streams.sequence('two_sample_bootstrap', 'CR'))
+
+for metric, summary in [('CTR', ctr_two_sample), ('CR', cr_two_sample)]:
+    result_store.extend(experiment_name, metric, 'two_sample_bootstrap:' + summary.index.to_numpy(dtype=object),
+                        statistic=summary['estimate'].to_numpy(), ci_low=summary['ci_low'].to_numpy(),
+                        ci_high=summary['ci_high'].to_numpy())
+
+display(ctr_two_sample)
+display(cr_two_sample)
+
+# ### Batched Normality and Variance Diagnostics
+# 
+# The assumption checks above call `shapiro`, `levene` and `probplot` one group and one metric at a time. Shapiro–Wilk is only defined up to n = 5000 in scipy, and at large n it rejects normality for deviations that do not matter to a t-test. `diagnose_metrics` runs a large-sample suite over every metric and group in one batched call:
+# 
+# - **Streaming moments**: `StreamingMoments` keeps count, mean and central moments M2–M4 per column. Chunks are combined with the pairwise update formulas, so skewness and kurtosis are available without storing the data.
+# - **D'Agostino K²**: the skewness and kurtosis z-tests combined into one χ²(2) statistic, computed directly from the streamed moments.
+# - **Anderson–Darling**: the normality test with estimated mean and variance, vectorized over a NaN-padded `(group × metric, n)` matrix, with Stephens' p-value approximation.
+# - **Brown–Forsythe**: Levene's test with median centring, robust to the skewness we see in CR.
+# 
+# The recommended test per metric is **Welch's t-test** when every group passes both normality tests, and **Mann–Whitney U** otherwise.
+
+# In[ ]:
+
+
+from scipy.stats import chi2, f as f_dist
+
+
+class StreamingMoments:
+    def __init__(self, n_columns):
+        self.n = np.zeros(n_columns)
+        self.mean = np.zeros(n_columns)
+        self.m2 = np.zeros(n_columns)
+        self.m3 = np.zeros(n_columns)
+        self.m4 = np.zeros(n_columns)
+
+    def update(self, chunk):
+        # chunk is (rows, n_columns); NaNs are ignored per column
+        chunk = np.asarray(chunk, dtype=np.float64).reshape(len(chunk), -1)
+        nb = (~np.isnan(chunk)).sum(axis=0).astype(np.float64)
+        if not nb.any():
+            return self
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean_b = np.where(nb > 0, np.nansum(chunk, axis=0) / nb, 0.0)
+        dev = np.nan_to_num(chunk - mean_b)
+        m2_b, m3_b, m4_b = (dev ** 2).sum(axis=0), (dev ** 3).sum(axis=0), (dev ** 4).sum(axis=0)
+
+        # Pairwise combination of central moments (Pébay's update formulas)
+        na, n = self.n, self.n + nb
+        delta = mean_b - self.mean
+        with np.errstate(invalid='ignore', divide='ignore'):
+            d_n = np.where(n > 0, delta / n, 0.0)
+        self.m4 = (self.m4 + m4_b + delta * d_n ** 3 * na * nb * (na ** 2 - na * nb + nb ** 2)
+                   + 6 * d_n ** 2 * (na ** 2 * m2_b + nb ** 2 * self.m2) + 4 * d_n * (na * m3_b - nb * self.m3))
+        self.m3 = (self.m3 + m3_b + delta * d_n ** 2 * na * nb * (na - nb) + 3 * d_n * (na * m2_b - nb * self.m2))
+        self.m2 = self.m2 + m2_b + delta * d_n * na * nb
+        self.mean = self.mean + d_n * nb
+        self.n = n
+        return self
+
+    @property
+    def variance(self):
+        return self.m2 / (self.n - 1)
+
+    @property
+    def skewness(self):
+        return np.sqrt(self.n) * self.m3 / self.m2 ** 1.5
+
+    @property
+    def kurtosis(self):
+        # Pearson (non-excess) kurtosis
+        return self.n * self.m4 / self.m2 ** 2
+
+
+def dagostino_k2(n, skewness, kurtosis):
+    # D'Agostino-Pearson K² from sample size, skewness and Pearson kurtosis (vectorized)
+    y = skewness * np.sqrt((n + 1) * (n + 3) / (6.0 * (n - 2)))
+    beta2 = 3.0 * (n ** 2 + 27 * n - 70) * (n + 1) * (n + 3) / ((n - 2.0) * (n + 5) * (n + 7) * (n + 9))
+    w2 = -1 + np.sqrt(2 * (beta2 - 1))
+    delta = 1 / np.sqrt(0.5 * np.log(w2))
+    alpha_ = np.sqrt(2.0 / (w2 - 1))
+    y = np.where(y == 0, 1, y)
+    z_skew = delta * np.log(y / alpha_ + np.sqrt((y / alpha_) ** 2 + 1))
+
+    expected = 3.0 * (n - 1) / (n + 1)
+    var_b2 = 24.0 * n * (n - 2) * (n - 3) / ((n + 1) ** 2 * (n + 3) * (n + 5))
+    x = (kurtosis - expected) / np.sqrt(var_b2)
+    sqrt_beta1 = 6.0 * (n * n - 5 * n + 2) / ((n + 7) * (n + 9)) * np.sqrt(6.0 * (n + 3) * (n + 5) / (n * (n - 2) * (n - 3)))
+    a = 6.0 + 8.0 / sqrt_beta1 * (2.0 / sqrt_beta1 + np.sqrt(1 + 4.0 / sqrt_beta1 ** 2))
+    denom = 1 + x * np.sqrt(2 / (a - 4.0))
+    term2 = np.sign(denom) * np.where(denom == 0, np.nan, ((1 - 2.0 / a) / np.abs(denom)) ** (1 / 3.0))
+    z_kurt = (1 - 2 / (9.0 * a) - term2) / np.sqrt(2 / (9.0 * a))
+
+    k2 = z_skew ** 2 + z_kurt ** 2
+    return k2, chi2.sf(k2, 2)
+
+
+def anderson_darling_normal(padded):
+    # Anderson-Darling normality test for each row of a NaN-padded (k, n_max) matrix
+    n = (~np.isnan(padded)).sum(axis=1)
+    ordered = np.sort(padded, axis=1)
+    mean = np.nanmean(padded, axis=1, keepdims=True)
+    std = np.nanstd(padded, axis=1, ddof=1, keepdims=True)
+    z = (ordered - mean) / std
+
+    # Pair the i-th smallest with the i-th largest valid value of each row
+    i = np.arange(padded.shape[1])[None, :]
+    valid = i < n[:, None]
+    mirror = np.clip(n[:, None] - 1 - i, 0, padded.shape[1] - 1)
+    z_mirror = np.take_along_axis(z, mirror, axis=1)
+    terms = (2 * i + 1) * (norm.logcdf(z) + norm.logsf(z_mirror))
+    a2 = -n - np.where(valid, terms, 0).sum(axis=1) / n
+    a2_star = a2 * (1 + 0.75 / n + 2.25 / n ** 2)
+
+    # Stephens (1986) p-value approximation for the case of estimated mean and variance
+    p = np.select(
+        [a2_star >= 0.6, a2_star >= 0.34, a2_star >= 0.2],
+        [np.exp(1.2937 - 5.709 * a2_star + 0.0186 * a2_star ** 2),
+         np.exp(0.9177 - 4.279 * a2_star - 1.38 * a2_star ** 2),
+         1 - np.exp(-8.318 + 42.796 * a2_star - 59.938 * a2_star ** 2)],
+        1 - np.exp(-13.436 + 101.14 * a2_star - 223.73 * a2_star ** 2))
+    return a2_star, np.clip(p, 0, 1)
+
+
+def brown_forsythe(padded_groups):
+    # padded_groups is (n_groups, n_metrics, n_max); one F-test per metric on |x - group median|
+    dev = np.abs(padded_groups - np.nanmedian(padded_groups, axis=2, keepdims=True))
+    n_g = (~np.isnan(dev)).sum(axis=2)
+    mean_g = np.nanmean(dev, axis=2)
+    n_total = n_g.sum(axis=0)
+    grand = (mean_g * n_g).sum(axis=0) / n_total
+    between = (n_g * (mean_g - grand) ** 2).sum(axis=0)
+    within = np.nansum((dev - mean_g[:, :, None]) ** 2, axis=(0, 2))
+    k = padded_groups.shape[0]
+    stat = (n_total - k) / (k - 1) * between / within
+    return stat, f_dist.sf(stat, k - 1, n_total - k)
+
+
+def diagnose_metrics(groups, metrics, alpha=0.05):
+    # groups maps a group name to anything indexable by metric name (a DataFrame or DerivedMetrics)
+    group_names = list(groups)
+    arrays = [[np.asarray(groups[g][m], dtype=np.float64) for m in metrics] for g in group_names]
+    n_max = max(len(a) for row in arrays for a in row)
+    padded = np.full((len(group_names), len(metrics), n_max), np.nan)
+    for gi, row in enumerate(arrays):
+        for mi, values in enumerate(row):
+            padded[gi, mi, :len(values)] = values
+
+    # Moments for every (group, metric) column in one streaming update
+    moments = StreamingMoments(len(group_names) * len(metrics)).update(padded.reshape(-1, n_max).T)
+    k2, k2_p = dagostino_k2(moments.n, moments.skewness, moments.kurtosis)
+    ad, ad_p = anderson_darling_normal(padded.reshape(-1, n_max))
+    bf, bf_p = brown_forsythe(padded)
+
+    index = pd.MultiIndex.from_product([group_names, metrics], names=['group', 'metric'])
+    per_group = pd.DataFrame({
+        'n': moments.n, 'mean': moments.mean, 'std': np.sqrt(moments.variance),
+        'skewness': moments.skewness, 'excess_kurtosis': moments.kurtosis - 3,
+        'k2': k2, 'k2_p_value': k2_p, 'anderson_darling': ad, 'anderson_darling_p_value': ad_p,
+    }, index=index).swaplevel().sort_index()
+
+    normal = ((per_group['k2_p_value'] > alpha) & (per_group['anderson_darling_p_value'] > alpha)).groupby(level='metric').all()
+    per_metric = pd.DataFrame({'brown_forsythe': bf, 'brown_forsythe_p_value': bf_p}, index=pd.Index(metrics, name='metric'))
+    per_metric['all_groups_normal'] = normal.reindex(per_metric.index)
+    per_metric['recommended_test'] = np.where(per_metric['all_groups_normal'], 'welch_t', 'mann_whitney_u')
+    return per_group, per_metric
+
+# In[ ]:
+
+
+# All metrics and both groups in one batched call
+diagnostics_per_group, diagnostics_per_metric = diagnose_metrics(
+    {'Control': control_group_imputed, 'Test': test_group_imputed}, ['CTR', 'CR'], alpha=alpha)
+
+display(diagnostics_per_group)
+display(diagnostics_per_metric)
+
+# - The test-group CTR is clearly right-skewed (K² p < 0.001), so the suite recommends the rank-based test for CTR as well. The Mann–Whitney result for CTR computed earlier (`mannwhitney_stat`, `mannwhitney_p_value`) is therefore the primary CTR comparison, and Welch's t-test is a cross-check.
+# - Brown–Forsythe confirms the unequal CTR variances that motivated `equal_var=False`.
+
+# ### Q-Q Plots from Quantile Sketches
+# 
+# `probplot(..., plot=plt)` sorts the whole sample and draws one marker per observation. With millions of rows that is slow, and the figure becomes an unreadable smear. A Q-Q plot only needs a fixed set of sample quantiles, and those can be read from a small, mergeable sketch built while the data is read:
+# 
+# - **`QuantileSketch`**: a merging digest. Values are buffered, then collapsed into weighted centroids whose resolution follows the `asin` scale function. The tails keep many small centroids and the middle a few large ones. Sketches from different chunks or workers merge by concatenating and re-compressing their centroids. The exact minimum and maximum are kept.
+# - **`ingest_metric_sketches`**: streams a campaign export once and updates one sketch per derived metric from each chunk.
+# - **`qq_points` / `plot_qq`**: read `n_quantiles` plotting positions from the sketch, pair them with normal quantiles, and fit the reference line. The figure has a fixed number of points whatever the sample size.
+
+# In[ ]:
+
+
+class QuantileSketch:
+    def __init__(self, compression=200, buffer_size=10_000):
+        self.compression = compression
+        self.buffer_size = buffer_size
+        self.means = np.empty(0)
+        self.weights = np.empty(0)
+        self.count = 0
+        self.min = np.inf
+        self.max = -np.inf
+        self._buffer = []
+        self._buffered = 0
+
+    def update(self, values, weights=None):
+        values = np.asarray(values, dtype=np.float64).ravel()
+        keep = ~np.isnan(values)
+        values = values[keep]
+        weights = np.ones_like(values) if weights is None else np.asarray(weights, dtype=np.float64).ravel()[keep]
+        if len(values) == 0:
+            return self
+        self._buffer.append((values, weights))
+        self._buffered += len(values)
+        self.count += weights.sum()
+        self.min = min(self.min, values.min())
+        self.max = max(self.max, values.max())
+        if self._buffered >= self.buffer_size:
+            self._compress()
+        return self
+
+    def merge(self, other):
+        other._compress()
+        self._buffer.append((other.means, other.weights))
+        self._buffered += len(other.means)
+        self.count += other.count
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        self._compress()
+        return self
+
+    def _compress(self):
+        if not self._buffer:
+            return
+        means = np.concatenate([self.means] + [m for m, _ in self._buffer])
+        weights = np.concatenate([self.weights] + [w for _, w in self._buffer])
+        self._buffer, self._buffered = [], 0
+        order = np.argsort(means, kind='stable')
+        means, weights = means[order], weights[order]
+
+        # Group neighbouring centroids that fall into the same unit of the asin scale function;
+        # the scale runs from 0 to compression, so compression bounds the number of centroids
+        q_center = (np.cumsum(weights) - weights / 2) / weights.sum()
+        k = self.compression / np.pi * (np.arcsin(2 * q_center - 1) + np.pi / 2)
+        cluster = np.floor(k).astype(np.int64)
+        _, cluster = np.unique(cluster, return_inverse=True)
+        self.weights = np.bincount(cluster, weights=weights)
+        self.means = np.bincount(cluster, weights=weights * means) / self.weights
+
+    def quantile(self, q):
+        self._compress()
+        centers = np.cumsum(self.weights) - self.weights / 2
+        positions = np.concatenate([[0.0], centers, [self.count]])
+        values = np.concatenate([[self.min], self.means, [self.max]])
+        return np.interp(np.asarray(q) * self.count, positions, values)
+
+
+def ingest_metric_sketches(path, metrics=('CTR', 'CR'), chunksize=100_000, compression=200):
+    # One pass over a campaign export; each chunk updates one sketch per derived metric
+    sketches = {metric: QuantileSketch(compression=compression) for metric in metrics}
+    for chunk in pd.read_csv(path, delimiter=';', chunksize=chunksize):
+        chunk_metrics = DerivedMetrics(chunk)
+        for metric, sketch in sketches.items():
+            sketch.update(chunk_metrics[metric])
+    return sketches
+
+
+def qq_points(sketch, n_quantiles=100):
+    # Normal Q-Q coordinates from a sketch, plus the least-squares reference line (as in probplot)
+    probabilities = (np.arange(1, n_quantiles + 1) - 0.5) / n_quantiles
+    theoretical = norm.ppf(probabilities)
+    sample = sketch.quantile(probabilities)
+    slope, intercept = np.polyfit(theoretical, sample, 1)
+    r = np.corrcoef(theoretical, sample)[0, 1]
+    return theoretical, sample, (slope, intercept, r)
+
+
+def plot_qq(ax, theoretical, sample, fit, title):
+    slope, intercept, r = fit
+    ax.plot(theoretical, sample, 'o', markersize=4, color='blue')
+    ax.plot(theoretical, intercept + slope * theoretical, 'r-')
+    ax.set_title(title)
+    ax.set_xlabel('Theoretical quantiles')
+    ax.set_ylabel('Ordered Values')
+
+# In[ ]:
+
+
+# Sketch CTR and CR while streaming both exports, then draw the Q-Q plots from the sketches
+campaign_sketches = {
+    'Control Group': ingest_metric_sketches('./control_group.csv', chunksize=10),
+    'Test Group': ingest_metric_sketches('./test_group.csv', chunksize=10),
+}
+
+fig, axes = plt.subplots(2, 2, figsize=(18, 8))
+for row, metric in enumerate(['CTR', 'CR']):
+    for col, (group, sketches) in enumerate(campaign_sketches.items()):
+        theoretical, sample, fit = qq_points(sketches[metric], n_quantiles=30)
+        plot_qq(axes[row, col], theoretical, sample, fit, f'Q-Q Plot for {metric} ({group}, sketch)')
+plt.tight_layout()
+plt.show()
+
+# In[ ]:
+
+
+# At production scale: 2 million skewed values in 20 chunks, sketched per chunk and merged
+rng_qq = analysis_streams.stream('qq_sketch_demo')
+large_sample = rng_qq.lognormal(mean=2.0, sigma=0.5, size=2_000_000)
+chunk_sketches = [QuantileSketch().update(chunk) for chunk in np.array_split(large_sample, 20)]
+large_sketch = chunk_sketches[0]
+for sketch in chunk_sketches[1:]:
+    large_sketch.merge(sketch)
+
+check_probabilities = np.array([0.001, 0.01, 0.25, 0.5, 0.75, 0.99, 0.999])
+sketch_error = large_sketch.quantile(check_probabilities) / np.quantile(large_sample, check_probabilities) - 1
+len(large_sketch.means), dict(zip(check_probabilities, np.round(sketch_error, 5)))
+
+# - The sketch of 2 million values has at most 200 centroids. Its quantiles are within 0.01% of the exact ones in the body of the distribution and within about 0.7% at the 0.1% / 99.9% tails, which is far below what is visible in a Q-Q plot.
+
+# ### Spend-Efficiency Metrics
+# 
+# `Spend [USD]` is loaded but never analysed, and a campaign that wins on CTR can still be the more expensive way to buy clicks and purchases. The cost metrics are registered in `METRIC_DEFINITIONS` next to CTR and CR:
+# 
+# - **CPC** = Spend / Clicks, **CPA** = Spend / Purchases, **CPM** = 1000 × Spend / Impressions, **Cost per Add to Cart** = Spend / Add to Cart
+# 
+# Each metric is compared as a **ratio of sums** over the test period, e.g. total spend / total clicks. This is the number finance reports, and it differs from the average of the daily ratios. `ratio_metric_comparison` evaluates every metric in one pass:
+# 
+# - **Delta method**: `Var(ΣN/ΣD) ≈ (s²_N − 2R·s_ND + R²·s²_D) / (n·mean(D)²)`, vectorized over metrics, gives a z-test and CI for the difference.
+# - **Bootstrap**: one count matrix of resampled days per group is multiplied with the numerator and denominator matrices of all metrics at once. CTR, CR and the cost metrics therefore share the same resamples.
+# 
+# For cost metrics lower is better, and the `favours` column takes that into account.
+
+# In[ ]:
+
+
+# Metrics where a lower value is the better outcome
+LOWER_IS_BETTER = {'CPC', 'CPA', 'CPM', 'Cost per Add to Cart'}
+
+
+def _ratio_inputs(frame, metrics):
+    # (n, m) numerator and denominator matrices for a set of ratio metrics
+    definitions = [METRIC_DEFINITIONS[m] for m in metrics]
+    num = frame[[numerator for numerator, _, _ in definitions]].to_numpy(dtype=np.float64)
+    den = frame[[denominator for _, denominator, _ in definitions]].to_numpy(dtype=np.float64)
+    keep = ~(np.isnan(num).any(axis=1) | np.isnan(den).any(axis=1))
+    return num[keep], den[keep], np.array([scale for _, _, scale in definitions])
+
+
+def _delta_ratio(num, den):
+    # Ratio of sums and its delta-method variance, per column
+    n = len(num)
+    ratio = num.sum(axis=0) / den.sum(axis=0)
+    cov = ((num - num.mean(axis=0)) * (den - den.mean(axis=0))).sum(axis=0) / (n - 1)
+    var = (num.var(axis=0, ddof=1) - 2 * ratio * cov + ratio ** 2 * den.var(axis=0, ddof=1)) / (n * den.mean(axis=0) ** 2)
+    return ratio, var
+
+
+def ratio_metric_comparison(control, test, metrics, n_bootstrap=2000, alpha=0.05, batch_size=500, rng=None):
+    rng = np.random.default_rng(rng)
+    num_c, den_c, scale = _ratio_inputs(control, metrics)
+    num_t, den_t, _ = _ratio_inputs(test, metrics)
+
+    ratio_c, var_c = _delta_ratio(num_c, den_c)
+    ratio_t, var_t = _delta_ratio(num_t, den_t)
+    diff = ratio_t - ratio_c
+    se = np.sqrt(var_c + var_t)
+    z = norm.ppf(1 - alpha / 2)
+
+    # Bootstrap all metrics together: one set of resample counts per group and batch
+    boot_diff = np.empty((n_bootstrap, len(metrics)))
+    for start in range(0, n_bootstrap, batch_size):
+        stop = min(start + batch_size, n_bootstrap)
+        counts_c = _resample_counts(rng, len(num_c), stop - start)
+        counts_t = _resample_counts(rng, len(num_t), stop - start)
+        boot_diff[start:stop] = (counts_t @ num_t) / (counts_t @ den_t) - (counts_c @ num_c) / (counts_c @ den_c)
+    boot_low, boot_high = np.percentile(boot_diff, [100 * alpha / 2, 100 * (1 - alpha / 2)], axis=0)
+
+    comparison = pd.DataFrame({
+        'control': ratio_c * scale,
+        'test': ratio_t * scale,
+        'difference': diff * scale,
+        'delta_ci_low': (diff - z * se) * scale,
+        'delta_ci_high': (diff + z * se) * scale,
+        'delta_p_value': 2 * norm.sf(np.abs(diff / se)),
+        'bootstrap_ci_low': boot_low * scale,
+        'bootstrap_ci_high': boot_high * scale,
+    }, index=pd.Index(metrics, name='metric'))
+
+    # Direction-aware verdict: a significant decrease in a cost metric favours the test campaign
+    test_better = np.where(comparison.index.isin(list(LOWER_IS_BETTER)), diff < 0, diff > 0)
+    comparison['favours'] = np.where(comparison['delta_p_value'] < alpha,
+                                     np.where(test_better, 'Test', 'Control'), 'No difference')
+    return comparison
+
+# In[ ]:
+
+
+# Engagement and cost metrics side by side, from one shared bootstrap
+efficiency_metrics = ['CTR', 'CR', 'CPC', 'CPA', 'CPM', 'Cost per Add to Cart']
+spend_efficiency = ratio_metric_comparison(control_group_imputed, test_group_imputed, efficiency_metrics,
+                                           n_bootstrap=n_bootstrap, alpha=alpha,
+                                           rng=analysis_streams.sequence('ratio_metric_comparison'))
+
+result_store.extend(experiment_name, efficiency_metrics, 'ratio_delta_method',
+                    statistic=spend_efficiency['difference'].to_numpy(),
+                    p_value=spend_efficiency['delta_p_value'].to_numpy(),
+                    ci_low=spend_efficiency['delta_ci_low'].to_numpy(),
+                    ci_high=spend_efficiency['delta_ci_high'].to_numpy())
+
+spend_efficiency
+
+# - The test campaign's higher CTR comes with a much higher CPM (about $34 vs $21 per thousand impressions), so the cost per click ends up practically the same.
+# - Cost per purchase does not differ significantly, and each add-to-cart costs the test campaign about $1.13 more. On spend efficiency the test campaign is not a clear winner, even though its CTR is.
+
+# ### Vectorized Welch's t-test
+# 
+# `ttest_ind(..., equal_var=False)` handles one pair of samples per call, and each call pays for scipy's argument handling and result object. The stages below, and batch jobs over many campaigns, metrics, windows or simulated replicates, need the same test for thousands of comparisons at once:
+# 
+# - `welch_ttest_from_stats(n1, mean1, var1, n2, mean2, var2)` takes broadcastable arrays of group sizes, means and sample variances. It returns the difference `mean1 - mean2`, its standard error, t, the Welch–Satterthwaite df, the p-value (`alternative` as in scipy) and the two-sided `1 - alpha` CI. Each of these is a single array expression, with `stdtr`/`stdtrit` from `scipy.special` for the t distribution.
+# - `welch_ttest_batch(a, b, axis=-1)` computes NaN-aware moments of stacked samples along `axis` and calls the function above. Argument order and sign match `ttest_ind(a, b, equal_var=False)`.
+
+# In[ ]:
+
+
+import time
+from scipy.special import stdtr, stdtrit
+
+
+def welch_ttest_from_stats(n1, mean1, var1, n2, mean2, var2, alpha=0.05, alternative='two-sided'):
+    # Welch's t-test of mean1 - mean2 for broadcastable arrays of sizes, means and sample variances
+    n1, mean1, var1, n2, mean2, var2 = (np.asarray(v, dtype=np.float64) for v in (n1, mean1, var1, n2, mean2, var2))
+    se1, se2 = var1 / n1, var2 / n2
+    with np.errstate(divide='ignore', invalid='ignore'):
+        se = np.sqrt(se1 + se2)
+        difference = mean1 - mean2
+        t_stat = difference / se
+        df = (se1 + se2) ** 2 / (se1 ** 2 / (n1 - 1) + se2 ** 2 / (n2 - 1))
+        if alternative == 'two-sided':
+            p_value = 2 * stdtr(df, -np.abs(t_stat))
+        elif alternative == 'greater':
+            p_value = stdtr(df, -t_stat)
+        elif alternative == 'less':
+            p_value = stdtr(df, t_stat)
+        else:
+            raise ValueError(f'Unknown alternative: {alternative!r}')
+        half_width = stdtrit(df, 1 - alpha / 2) * se
+    return {'difference': difference, 'se': se, 't_stat': t_stat, 'df': df, 'p_value': p_value,
+            'ci_low': difference - half_width, 'ci_high': difference + half_width}
+
+
+def _sample_moments(values, axis=-1):
+    # NaN-aware count, mean and sample variance along an axis (two-pass for accuracy)
+    values = np.asarray(values, dtype=np.float64)
+    observed = ~np.isnan(values)
+    n = observed.sum(axis=axis)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mean = np.where(observed, values, 0.0).sum(axis=axis) / n
+        deviations = np.where(observed, values - np.expand_dims(mean, axis), 0.0)
+        var = (deviations ** 2).sum(axis=axis) / (n - 1)
+    return n, mean, var
+
+
+def welch_ttest_batch(a, b, axis=-1, alpha=0.05, alternative='two-sided'):
+    return welch_ttest_from_stats(*_sample_moments(a, axis), *_sample_moments(b, axis), alpha=alpha,
+                                  alternative=alternative)
+
+# In[ ]:
+
+
+# Same result as the scipy call in the Welch section
+ctr_welch = welch_ttest_batch(control_group_cleaned['CTR'], test_group['CTR'], alpha=alpha)
+print('t = {t_stat:.4f}, df = {df:.2f}, p = {p_value:.6f}'.format(**ctr_welch), '| scipy:', round(welch_t_stat, 4), round(welch_p_value, 6))
+
+# Throughput: scipy one pair at a time vs. stacked samples vs. (n, mean, var) vectors
+rng_welch = analysis_streams.stream('welch_batch_demo')
+stacked_a = rng_welch.normal(5.0, 1.5, size=(100_000, 30))
+stacked_b = rng_welch.normal(5.1, 2.0, size=(100_000, 30))
+
+start = time.perf_counter()
+scipy_p = np.array([ttest_ind(x, y, equal_var=False).pvalue for x, y in zip(stacked_a[:2000], stacked_b[:2000])])
+scipy_rate = 2000 / (time.perf_counter() - start)
+
+start = time.perf_counter()
+batch = welch_ttest_batch(stacked_a, stacked_b)
+batch_rate = len(stacked_a) / (time.perf_counter() - start)
+
+n_stats = np.full(2_000_000, 30)
+means_a, means_b = rng_welch.normal(5.0, 0.3, size=(2, len(n_stats)))
+vars_a, vars_b = rng_welch.gamma(20, 0.1, size=(2, len(n_stats)))
+start = time.perf_counter()
+from_stats = welch_ttest_from_stats(n_stats, means_a, vars_a, n_stats, means_b, vars_b)
+stats_rate = len(n_stats) / (time.perf_counter() - start)
+
+print('max |p - scipy p|:', np.abs(batch['p_value'][:2000] - scipy_p).max())
+pd.Series({'scipy ttest_ind loop': scipy_rate, 'welch_ttest_batch (30 + 30 values)': batch_rate,
+           'welch_ttest_from_stats': stats_rate}, name='tests per second').round(-3)
+
+# - The batch function reproduces the scipy results above exactly (t = -3.98, p = 0.00034), and across 2,000 random comparisons it agrees with `ttest_ind` to about 1e-15.
+# - On this machine the scipy loop manages roughly 800 tests per second. Stacked 30 + 30 samples run at roughly 400,000 per second and (n, mean, var) vectors at roughly 800,000 per second, a speed-up of about 500–1,000×. Most of the remaining time goes to the `stdtrit` quantile for the CIs.
+# - The rolling lift stage, the out-of-core `aggregate_tests`, the analysis service's `/ci` endpoint and the Monte Carlo power engine all use these functions now.
+
+# ### Rolling and Cumulative Lift over Time
+# 
+# The `Date` column has not been used so far, so we cannot tell whether the test campaign's CTR advantage held through August or faded after the first days. On the date-aligned days from the paired analysis, this stage computes for every day:
+# 
+# - **Cumulative lift**: the comparison of all days up to and including that day, i.e. what a daily peek at the running test would have shown.
+# - **Rolling lift**: the comparison within a trailing window (7 days by default), which shows local changes in the effect.
+# 
+# Each day gets the relative lift `mean(test) / mean(control) - 1` with Fieller's CI, plus Welch's t statistic, degrees of freedom and p-value. Fieller's interval holds every ratio $r$ with $|\bar{x}_t - r\,\bar{x}_c| \le t_{crit} \sqrt{se_t^2 + r^2 se_c^2}$. At $r = 1$ that is exactly Welch's test with the same df, so the lift CI excludes zero exactly when $p < \alpha$. Where the control mean itself is not distinguishable from zero, the interval is unbounded and reported as NaN. Every window is read from prefix sums of the values and their squares. Each day costs O(1) whatever the window length, and the whole series is a handful of array operations, about as cheap as a single test. Values are centred before summing, so the sums of squares do not lose precision.
+# 
+# Cumulative p-values from a daily peek are not corrected for repeated looks. They show how the evidence builds up over time and are not a stopping rule.
+
+# In[ ]:
+
+
+def window_moments(values, window=None):
+    # Count, mean and variance for every day over a trailing window (None = cumulative), from prefix sums
+    values = np.asarray(values, dtype=np.float64)
+    observed = ~np.isnan(values)
+    shift = np.nanmean(values)
+    centred = np.where(observed, values - shift, 0.0)
+    prefix = np.zeros((3, len(values) + 1))
+    prefix[0, 1:] = np.cumsum(observed)
+    prefix[1, 1:] = np.cumsum(centred)
+    prefix[2, 1:] = np.cumsum(centred ** 2)
+
+    end = np.arange(1, len(values) + 1)
+    start = np.zeros_like(end) if window is None else np.maximum(end - window, 0)
+    n, s, ss = prefix[:, end] - prefix[:, start]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mean = s / n
+        var = (ss - s * mean) / (n - 1)
+    return n, mean + shift, var
+
+
+def temporal_lift(dates, control_values, test_values, window=None, alpha=0.05):
+    n_c, mean_c, var_c = window_moments(control_values, window)
+    n_t, mean_t, var_t = window_moments(test_values, window)
+
+    # Welch's t-test for each day's window
+    welch = welch_ttest_from_stats(n_t, mean_t, var_t, n_c, mean_c, var_c, alpha=alpha)
+    t_stat, df, p_value = welch['t_stat'], welch['df'], welch['p_value']
+
+    # Relative lift with Fieller's interval for the ratio of means: the roots of
+    # (mean_t - r mean_c)^2 = t_crit^2 (se_t2 + r^2 se_c2), bounded only while mean_c^2 > t_crit^2 se_c2
+    se_c2, se_t2 = var_c / n_c, var_t / n_t
+    t_crit = stdtrit(df, 1 - alpha / 2)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        lift = mean_t / mean_c - 1
+        a = mean_c ** 2 - t_crit ** 2 * se_c2
+        half_width = t_crit * np.sqrt(mean_t ** 2 * se_c2 + a * se_t2) / a
+        centre = mean_t * mean_c / a
+    bounded = a > 0
+    lift_ci_low = np.where(bounded, centre - half_width - 1, np.nan)
+    lift_ci_high = np.where(bounded, centre + half_width - 1, np.nan)
+
+    return pd.DataFrame({
+        'n_days': n_t, 'control_mean': mean_c, 'test_mean': mean_t,
+        'lift': lift, 'lift_ci_low': lift_ci_low, 'lift_ci_high': lift_ci_high,
+        't_stat': t_stat, 'df': df, 'p_value': p_value,
+    }, index=pd.DatetimeIndex(dates, name='Date'))
+
+# In[ ]:
+
+
+# Cumulative and 7-day rolling CTR lift on the date-aligned days
+ctr_cumulative_lift = temporal_lift(paired_days['Date'], paired_days['CTR (Control)'], paired_days['CTR (Test)'], alpha=alpha)
+ctr_rolling_lift = temporal_lift(paired_days['Date'], paired_days['CTR (Control)'], paired_days['CTR (Test)'],
+                                 window=7, alpha=alpha)
+
+plt.figure(figsize=(14, 6))
+for frame, color, label in [(ctr_cumulative_lift, 'blue', 'Cumulative'), (ctr_rolling_lift, 'green', '7-day rolling')]:
+    shown = frame[frame['n_days'] >= 3]
+    plt.plot(shown.index, shown['lift'] * 100, color=color, label=f'{label} CTR lift')
+    plt.fill_between(shown.index, shown['lift_ci_low'] * 100, shown['lift_ci_high'] * 100, color=color, alpha=0.15)
+plt.axhline(0, color='black', linestyle='--')
+plt.title('CTR Lift of Test over Control by Day')
+plt.xlabel('Date')
+plt.ylabel('Lift (%)')
+plt.legend()
+plt.grid(True)
+plt.show()
+
+# Fieller's CI and Welch's p-value agree on every window, here and on a clear-cut synthetic series
+lift_check_rng = analysis_streams.stream('temporal_lift_check')
+lift_check_frames = [ctr_cumulative_lift, ctr_rolling_lift,
+                     temporal_lift(pd.date_range('2019-08-01', periods=30), lift_check_rng.normal(10, 1, 30),
+                                   lift_check_rng.normal(13, 1, 30), window=7, alpha=alpha)]
+for frame in lift_check_frames:
+    checked = frame.dropna(subset=['lift_ci_low', 'p_value'])
+    excludes_zero = (checked['lift_ci_low'] > 0) | (checked['lift_ci_high'] < 0)
+    assert (excludes_zero == (checked['p_value'] < alpha)).all()
+assert lift_check_frames[-1]['p_value'].iloc[-1] < alpha and lift_check_frames[-1]['lift_ci_low'].iloc[-1] > 0
+
+ctr_cumulative_lift[['lift', 'lift_ci_low', 'lift_ci_high', 'p_value']].iloc[[6, 13, 20, -1]]
+
+# - The cumulative CTR lift is significant from 9 August (day 9) on and stays between about +85% and +125% from then on. It ends at +103% (CI +48% to +166%, p ≈ 0.0003), so the advantage does not decay over the month.
+# - Of the 24 full 7-day windows, 8 reach p < 0.05 (smallest p ≈ 0.020). They fall between 9 and 14 August, on 18 August and on 24 August. The windowed lift ranges from about +33% to +201%. The significant windows are spread over the month and the lift has no trend. The wide rolling bands come from the test campaign's volatile daily CTR, not from a change in the effect.
+
+# ### Novelty and Day-of-Week Decomposition
+# 
+# A flat `ttest_ind` cannot tell whether the test campaign's higher CTR is a lasting effect, a novelty spike in the first days, or an artefact of which weekdays had strong traffic. Both groups are stacked into one regression per experiment and metric:
+# 
+# `y = b0 + b1·test + b2·trend + b3·test×trend + b4·test×novelty + day-of-week dummies + ε`
+# 
+# - **`test`**: the treatment effect net of weekday and trend components, measured at the midpoint of the period (the trend is centred).
+# - **`test×trend`**: the daily change in the effect. A negative value next to a positive effect means the lift is wearing off.
+# - **`test×novelty`**: the extra effect during the first `novelty_days` days.
+# - **Day-of-week dummies** (Monday is the baseline) are shared by both groups, because weekday patterns affect the whole market.
+# 
+# All experiments and metrics are solved together. Designs are stacked into an `(experiment, row, term)` array, and shorter experiments are padded with zero rows, which add nothing to `XᵀX`. One batched `np.linalg.solve` then fits every metric of every experiment, so hundreds of experiments cost about as much as one.
+
+# In[ ]:
+
+
+DECOMPOSITION_TERMS = ['intercept', 'test', 'trend', 'test x trend', 'test x novelty'] + \
+    [f'dow_{day}' for day in ['Tue', 'Wed', 'Thu', 'Fri', 'Sat', 'Sun']]
+
+
+def decomposition_design(dates, is_test, novelty_days=7):
+    dates = pd.DatetimeIndex(dates)
+    days = np.asarray((dates - dates.min()).days, dtype=np.float64)
+    trend = days - days.mean()
+    is_test = np.asarray(is_test, dtype=np.float64)
+    dow = np.asarray(dates.dayofweek)[:, None] == np.arange(1, 7)[None, :]
+    return np.column_stack([np.ones_like(days), is_test, trend, is_test * trend,
+                            is_test * (days < novelty_days), dow.astype(np.float64)])
+
+
+def fit_decomposition(experiments, metrics, novelty_days=7):
+    # experiments maps a name to a date-aligned frame as returned by align_campaign_days
+    names = list(experiments)
+    n_rows = [2 * len(experiments[name]) for name in names]
+    n_max, n_terms = max(n_rows), len(DECOMPOSITION_TERMS)
+    X = np.zeros((len(names), n_max, n_terms))
+    Y = np.zeros((len(names), n_max, len(metrics)))
+    for e, name in enumerate(names):
+        frame = experiments[name]
+        dates = np.concatenate([frame['Date'], frame['Date']])
+        is_test = np.repeat([0, 1], len(frame))
+        X[e, :n_rows[e]] = decomposition_design(dates, is_test, novelty_days)
+        Y[e, :n_rows[e]] = np.vstack([frame[[f'{m} (Control)' for m in metrics]].to_numpy(dtype=np.float64),
+                                      frame[[f'{m} (Test)' for m in metrics]].to_numpy(dtype=np.float64)])
+
+    # Batched normal equations across experiments, with all metrics as right-hand sides
+    xtx = X.transpose(0, 2, 1) @ X
+    coef = np.linalg.solve(xtx, X.transpose(0, 2, 1) @ Y)
+    resid = Y - X @ coef
+    df_resid = np.asarray(n_rows, dtype=np.float64) - n_terms
+    sigma2 = (resid ** 2).sum(axis=1) / df_resid[:, None]
+    xtx_inv_diag = np.diagonal(np.linalg.inv(xtx), axis1=1, axis2=2)
+    se = np.sqrt(xtx_inv_diag[:, :, None] * sigma2[:, None, :])
+    t_stat = coef / se
+    p_value = 2 * stdtr(df_resid[:, None, None], -np.abs(t_stat))
+
+    index = pd.MultiIndex.from_product([names, DECOMPOSITION_TERMS, metrics], names=['experiment', 'term', 'metric'])
+    return pd.DataFrame({
+        'coefficient': coef.ravel(), 'std_error': se.ravel(), 't_stat': t_stat.ravel(), 'p_value': p_value.ravel(),
+    }, index=index).reorder_levels(['experiment', 'metric', 'term']).sort_index(level=['experiment', 'metric'], sort_remaining=False)
+
+# In[ ]:
+
+
+# Decompose CTR and CR for this experiment; more experiments are simply more entries in the dict
+decomposition = fit_decomposition({experiment_name: paired_days}, ['CTR', 'CR'], novelty_days=7)
+
+net_effects = decomposition.xs('test', level='term').copy()
+net_effects['raw_difference'] = [paired_results[m]['mean_diff'] for m in net_effects.index.get_level_values('metric')]
+display(net_effects)
+decomposition.loc[(experiment_name, 'CTR')]
+
+# - Net of weekday and trend components, the CTR effect is about +6.2 points (p ≈ 0.0002), slightly above the raw +5.2.
+# - Neither the novelty term nor the effect trend is significant for either metric. If anything, the first week was weaker for the test campaign. The CTR advantage is therefore not a novelty effect, and no weekday explains it.
+
+# ### Result Caching
+# 
+# Re-running the notebook recomputes every test, effect size, power solve and bootstrap, even when neither the CSVs nor the parameters changed. `ResultCache` is a content-addressed on-disk cache for these stages:
+# 
+# - **Key**: a SHA-256 over the cache's `namespace`, the stage function and every bound argument, including defaults such as `n_bootstrap` and `alpha`. The function is identified by its qualified name and the bytecode of itself and of every module-level function it calls, transitively. Editing the stage or a helper such as `_resample_counts` therefore invalidates its entries. Changes the bytecode cannot see, such as edited methods of classes a stage uses or a newer library version, are covered by bumping `namespace`. Arrays and frames are hashed by content (`hash_pandas_object` for pandas). Seeds are hashed by value: integers as they are, a `SeedSequence` by its entropy, spawn key, pool size and number of spawned children.
+# - **Storage**: one pickle per key under `./.ab_test_cache/`, written atomically through a unique temporary file, so threads (the pipeline's pool, the service's executor) can store the same key concurrently. Every hit refreshes the file's modification time. When the cache grows beyond `max_bytes`, the least recently used entries are evicted. Entries that another thread has already removed are skipped.
+# - **Transparent use**: `cache.cached(func)` returns a drop-in replacement for `func`. Calls with `rng=None` bypass the cache, because an unseeded stage is not reproducible and must not be served a stale draw. Calls that pass a `Generator` (or any other stateful generator object) bypass it too. A miss would advance the generator and a hit would not, so later draws from the same generator would depend on what happened to be cached. The stages therefore receive `analysis_streams.sequence(...)` seeds instead of generators. Setting `cache.enabled = False` bypasses it for every call, e.g. while profiling.
+# 
+# The stage functions below are rebound to their cached versions, so later cells and re-runs read from the cache without any change. scipy's `ttest_ind` result object cannot be pickled, so Welch's test is cached through the small `welch_ttest` wrapper, which returns `(statistic, p-value)`.
+
+# In[ ]:
+
+
+import hashlib
+import json
+import pickle
+import functools
+import inspect
+import tempfile
+import types
+
+
+def _update_fingerprint(digest, value):
+    if isinstance(value, (pd.DataFrame, pd.Series, pd.Index)):
+        digest.update(type(value).__name__.encode())
+        names = list(value.columns) if isinstance(value, pd.DataFrame) else [value.name]
+        digest.update(repr(names).encode())
+        digest.update(pd.util.hash_pandas_object(value, index=not isinstance(value, pd.Index)).to_numpy().tobytes())
+    elif isinstance(value, np.ndarray):
+        digest.update(f'ndarray{value.dtype.str}{value.shape}'.encode())
+        digest.update(np.ascontiguousarray(value).tobytes() if value.dtype != object else pickle.dumps(value.tolist()))
+    elif isinstance(value, np.random.SeedSequence):
+        _update_fingerprint(digest, ('SeedSequence', value.entropy, value.spawn_key, value.pool_size,
+                                     value.n_children_spawned))
+    elif isinstance(value, DerivedMetrics):
+        _update_fingerprint(digest, (value.frame, value.dtype.str, sorted(value.definitions.items())))
+    elif isinstance(value, dict):
+        digest.update(b'dict')
+        for key in sorted(value, key=repr):
+            _update_fingerprint(digest, key)
+            _update_fingerprint(digest, value[key])
+    elif isinstance(value, (list, tuple, set, frozenset)):
+        digest.update(type(value).__name__.encode())
+        for item in (sorted(value, key=repr) if isinstance(value, (set, frozenset)) else value):
+            _update_fingerprint(digest, item)
+    elif value is None or isinstance(value, (bool, int, float, complex, str, bytes, np.generic, np.dtype)):
+        digest.update(f'{type(value).__name__}:{value!r}'.encode())
+    elif callable(value):
+        _update_fingerprint(digest, _function_identity(value))
+    else:
+        raise TypeError(f"Cannot fingerprint a value of type {type(value).__name__}")
+
+
+def fingerprint(value):
+    digest = hashlib.sha256()
+    _update_fingerprint(digest, value)
+    return digest.hexdigest()
+
+
+def _code_objects(code):
+    # A code object plus the code of its nested functions, lambdas and comprehensions
+    yield code
+    for const in code.co_consts:
+        if isinstance(const, types.CodeType):
+            yield from _code_objects(const)
+
+
+def _function_identity(func):
+    # Qualified name plus a hash of the bytecode and constants of the function and of every module-level
+    # function it calls (transitively), so editing the function or one of its helpers gives new keys
+    func = inspect.unwrap(func)
+    name = (getattr(func, '__module__', ''), getattr(func, '__qualname__', repr(func)))
+    if not isinstance(func, types.FunctionType):
+        return name + ('',)
+    digest = hashlib.sha256()
+    seen, pending = set(), [func]
+    while pending:
+        current = pending.pop()
+        if current.__code__ in seen:
+            continue
+        seen.add(current.__code__)
+        digest.update(current.__qualname__.encode())
+        names = set()
+        for code in _code_objects(current.__code__):
+            # Nested code objects are hashed on their own; their repr would embed a memory address
+            consts = tuple(c.co_name if isinstance(c, types.CodeType) else c for c in code.co_consts)
+            digest.update(code.co_code + repr(consts).encode())
+            names.update(code.co_names)
+        for dependency_name in sorted(names, reverse=True):
+            dependency = current.__globals__.get(dependency_name)
+            if callable(dependency):
+                dependency = inspect.unwrap(dependency)
+            if isinstance(dependency, types.FunctionType) and dependency.__module__ == func.__module__:
+                pending.append(dependency)
+    return name + (digest.hexdigest(),)
+
+
+_STATEFUL_GENERATORS = (np.random.Generator, np.random.BitGenerator, np.random.RandomState)
+
+
+class ResultCache:
+    def __init__(self, directory='./.ab_test_cache', max_bytes=512 * 1024 ** 2, namespace=''):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.namespace = namespace  # bump to invalidate every entry at once
+        self.enabled = True
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.directory, key[:2], key + '.pkl')
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as fh:
+                value = pickle.load(fh)
+        except (FileNotFoundError, EOFError, pickle.UnpicklingError):
+            self.misses += 1
+            return False, None
+        try:
+            os.utime(path)  # mark as recently used
+        except FileNotFoundError:
+            pass  # evicted by another thread after the read
+        self.hits += 1
+        return True, value
+
+    def set(self, key, value):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        try:
+            payload = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        except (pickle.PicklingError, TypeError, AttributeError):
+            return False  # values that cannot be pickled are simply not cached
+        # A unique temporary file per writer, so concurrent writes of the same key cannot collide
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as fh:
+                fh.write(payload)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+        self.evict()
+        return True
+
+    def evict(self):
+        # Drop least recently used entries until the cache fits into max_bytes
+        entries = []
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                if name.endswith('.pkl'):
+                    try:
+                        stat = os.stat(os.path.join(root, name))
+                    except FileNotFoundError:
+                        continue  # removed by another thread meanwhile
+                    entries.append((stat.st_mtime, stat.st_size, os.path.join(root, name)))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+
+    def clear(self):
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                if name.endswith('.pkl'):
+                    try:
+                        os.remove(os.path.join(root, name))
+                    except FileNotFoundError:
+                        pass
+
+    def cached(self, func):
+        if getattr(func, '_result_cache', None) is self:
+            return func
+        signature = inspect.signature(func)
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            bound = signature.bind(*args, **kwargs)
+            bound.apply_defaults()
+            if not self.enabled or ('rng' in bound.arguments and bound.arguments['rng'] is None):
+                return func(*args, **kwargs)
+            # A generator is advanced by a miss but not by a hit, so its later draws would depend on the cache
+            if any(isinstance(value, _STATEFUL_GENERATORS) for value in bound.arguments.values()):
+                return func(*args, **kwargs)
+            key = fingerprint((self.namespace, _function_identity(func), dict(bound.arguments)))
+            hit, value = self.get(key)
+            if not hit:
+                value = func(*args, **kwargs)
+                self.set(key, value)
+            return value
+
+        wrapper._result_cache = self
+        return wrapper
+
+# In[ ]:
+
+
+# Route the stages through the cache; later cells and re-runs pick up the cached versions transparently
+analysis_cache = ResultCache('./.ab_test_cache')
+
+
+def welch_ttest(control, test):
+    # Picklable (statistic, p-value) form of ttest_ind(..., equal_var=False); scipy's result object cannot be pickled
+    result = ttest_ind(control, test, equal_var=False)
+    return float(result.statistic), float(result.pvalue)
+
+
+welch_ttest = analysis_cache.cached(welch_ttest)
+mannwhitneyu = analysis_cache.cached(mannwhitneyu)
+cohen_d = analysis_cache.cached(cohen_d)
+cliffs_delta_manual = analysis_cache.cached(cliffs_delta_manual)
+paired_tests = analysis_cache.cached(paired_tests)
+permutation_test = analysis_cache.cached(permutation_test)
+bootstrap_ci = analysis_cache.cached(bootstrap_ci)
+two_sample_bootstrap = analysis_cache.cached(two_sample_bootstrap)
+ratio_metric_comparison = analysis_cache.cached(ratio_metric_comparison)
+solve_power = analysis_cache.cached(power_analysis.solve_power)
+
+# In[ ]:
+
+
+# The second call with unchanged data and parameters is served from disk
+timings = {}
+for attempt in ['first call', 'second call']:
+    start = time.perf_counter()
+    cached_ctr_summary, _ = two_sample_bootstrap(control_ctr, test_ctr, n_bootstrap=n_bootstrap, rng=analysis_streams.sequence('two_sample_bootstrap', 'CTR'))
+    cached_required_n = solve_power(effect_size=effect_size_cr, power=0.80, alpha=alpha, ratio=1.0)
+    timings[attempt] = time.perf_counter() - start
+
+timings, {'hits': analysis_cache.hits, 'misses': analysis_cache.misses}
+
+# ### Stage Pipeline with Incremental Recomputation
+# 
+# The analysis above is a linear chain of cells sharing globals (`control_group_cleaned`, `test_group`, `cohen_d_ctr`, `effect_size_ctr`, ...). After any change, the safe thing is to re-run everything. The same analysis is declared here as a graph of stages with explicit inputs and outputs:
+# 
+# `load → clean → metrics → {CTR, CR} × (tests, effect sizes → power, bootstrap) → plots`
+# 
+# - **`Stage`**: a function plus a mapping from its parameters to named inputs. Inputs are either pipeline parameters (paths, `alpha`, `n_bootstrap`, `seed`, ...) or outputs of other stages.
+# - **Incremental runs**: before a stage runs, its input values are fingerprinted with the same content hash as the result cache. A stage whose inputs are unchanged since its last run is skipped and keeps its outputs. A change therefore only reruns the stages downstream of it, and it stops early when a recomputed output turns out identical.
+# - **External inputs**: the `load` stage only receives path strings, which stay the same when a CSV is overwritten. Its `watch` function adds each file's size and modification time to the fingerprint, so a changed export reruns `load`. `clean` and everything after it only rerun if the loaded frames actually differ.
+# - **Concurrency**: stages run on a thread pool as soon as their inputs are ready, so the independent CTR and CR branches run side by side. Stages marked `concurrent=False` (plotting, since pyplot is not thread-safe) run on the main thread.
+# 
+# After each run, `pipeline.last_run` lists the stages that were actually executed.
+
+# In[ ]:
+
+
+import itertools
+import threading
+from concurrent.futures import FIRST_COMPLETED, wait
+
+
+class Stage:
+    def __init__(self, name, func, inputs, outputs, concurrent=True, watch=None):
+        self.name = name
+        self.func = func
+        # inputs maps parameter name -> pipeline value name; a list means the names are the same
+        self.inputs = dict(inputs) if isinstance(inputs, dict) else {name_: name_ for name_ in inputs}
+        self.outputs = [outputs] if isinstance(outputs, str) else list(outputs)
+        self.concurrent = concurrent
+        # watch(**kwargs) describes state outside the pipeline (e.g. files) and joins the input fingerprint
+        self.watch = watch
+
+
+def file_signatures(**paths):
+    # Size and modification time of each file, so an overwritten file changes the fingerprint
+    return {param: (os.stat(path).st_size, os.stat(path).st_mtime_ns) for param, path in paths.items()}
+
+
+def _count_rows(value):
+    # Rows held in a stage output (frames and arrays, also inside tuples and dicts); None if there are none
+    if isinstance(value, (pd.DataFrame, pd.Series, np.ndarray)):
+        return len(value)
+    if isinstance(value, (tuple, list, dict)):
+        counts = [_count_rows(v) for v in (value.values() if isinstance(value, dict) else value)]
+        counts = [c for c in counts if c is not None]
+        return sum(counts) if counts else None
+    return None
+
+
+_UNHASHABLE_COUNTER = itertools.count()
+
+
+def _value_fingerprint(value):
+    # Values that cannot be content-hashed get a fresh token, so their consumers always rerun
+    try:
+        return fingerprint(value)
+    except TypeError:
+        return f'unhashable-{next(_UNHASHABLE_COUNTER)}'
+
+
+class Pipeline:
+    def __init__(self, stages, max_workers=4, profiler=None):
+        self.stages = {stage.name: stage for stage in stages}
+        self.max_workers = max_workers
+        self.profiler = profiler
+        self.producers = {output: stage.name for stage in stages for output in stage.outputs}
+        self.values = {}
+        self.value_fingerprints = {}
+        self.stage_fingerprints = {}
+        self.last_run = []
+        self._lock = threading.Lock()
+
+    def dependencies(self, stage):
+        return {self.producers[source] for source in stage.inputs.values() if source in self.producers}
+
+    def _required_stages(self, targets):
+        required, pending = set(), list(targets)
+        while pending:
+            name = pending.pop()
+            if name not in required:
+                required.add(name)
+                pending.extend(self.dependencies(self.stages[name]))
+        return required
+
+    def set_params(self, **params):
+        for name, value in params.items():
+            if name in self.producers:
+                raise ValueError(f"{name!r} is produced by stage {self.producers[name]!r} and cannot be set directly")
+            self.values[name] = value
+            self.value_fingerprints[name] = _value_fingerprint(value)
+
+    def _execute(self, stage):
+        kwargs = {param: self.values[source] for param, source in stage.inputs.items()}
+        input_fingerprint = fingerprint((sorted((param, self.value_fingerprints[source])
+                                                for param, source in stage.inputs.items()),
+                                         None if stage.watch is None else stage.watch(**kwargs)))
+        if self.stage_fingerprints.get(stage.name) == input_fingerprint:
+            return False
+
+        if self.profiler is None:
+            result = stage.func(**kwargs)
+        else:
+            with self.profiler.stage(stage.name) as record:
+                result = stage.func(**kwargs)
+                record['rows'] = _count_rows(result)
+        result = (result,) if len(stage.outputs) == 1 else tuple(result)
+        with self._lock:
+            for output, value in zip(stage.outputs, result):
+                self.values[output] = value
+                self.value_fingerprints[output] = _value_fingerprint(value)
+            self.stage_fingerprints[stage.name] = input_fingerprint
+            self.last_run.append(stage.name)
+        return True
+
+    def run(self, targets=None, **params):
+        self.set_params(**params)
+        required = self._required_stages(targets or list(self.stages))
+        missing = {source for name in required for source in self.stages[name].inputs.values()
+                   if source not in self.producers and source not in self.values}
+        if missing:
+            raise KeyError(f"Missing pipeline parameters: {sorted(missing)}")
+
+        self.last_run = []
+        done, running = set(), {}
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            while len(done) < len(required):
+                ready = [name for name in required - done - set(running.values())
+                         if self.dependencies(self.stages[name]) <= done]
+                if not ready and not running:
+                    raise RuntimeError(f"Pipeline stages form a cycle: {sorted(required - done)}")
+                for name in ready:
+                    if self.stages[name].concurrent:
+                        running[pool.submit(self._execute, self.stages[name])] = name
+                    else:
+                        self._execute(self.stages[name])
+                        done.add(name)
+                if running:
+                    finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                    for future in finished:
+                        future.result()
+                        done.add(running.pop(future))
+        return {output: self.values[output] for name in required for output in self.stages[name].outputs}
+
+# In[ ]:
+
+
+# Stage functions of the CTR / CR analysis
+EFFECT_SIZE_FUNCTIONS = {'CTR': ('cohens_d', cohen_d), 'CR': ('cliffs_delta', cliffs_delta_manual)}
+
+
+def stage_load(control_path, test_path):
+    return pd.read_csv(control_path, delimiter=';'), pd.read_csv(test_path, delimiter=';')
+
+
+def stage_clean(control_raw, test_raw, imputation_method):
+    imputed, _, _ = impute_missing_days([control_raw, test_raw], method=imputation_method)
+    return tuple(imputed.values())
+
+
+def stage_metrics(control, test):
+    return {group: pd.DataFrame(DerivedMetrics(frame).derive_all(['CTR', 'CR']))
+            for group, frame in [('Control', control), ('Test', test)]}
+
+
+def stage_tests(metrics, metric):
+    control, test = metrics['Control'][metric], metrics['Test'][metric]
+    mw = mannwhitneyu(control, test, alternative='two-sided')
+    return {'welch_t': welch_ttest(control, test), 'mann_whitney_u': (float(mw.statistic), float(mw.pvalue))}
+
+
+def stage_effect_size(metrics, metric):
+    name, func = EFFECT_SIZE_FUNCTIONS[metric]
+    control, test = metrics['Control'][metric], metrics['Test'][metric]
+    return {'cohens_d': float(cohen_d(control, test)), name: float(func(control, test))}
+
+
+def stage_power(effect_size, metrics, alpha):
+    d = abs(effect_size['cohens_d'])
+    nobs = len(metrics['Control'])
+    return {'power': power_analysis.power(effect_size=d, nobs1=nobs, alpha=alpha, ratio=1.0),
+            'required_n': solve_power(effect_size=d, power=0.80, alpha=alpha, ratio=1.0)}
+
+
+def stage_bootstrap(metrics, metric, n_bootstrap, alpha, seed):
+    summary, _ = two_sample_bootstrap(metrics['Control'][metric], metrics['Test'][metric],
+                                      n_bootstrap=n_bootstrap, alpha=alpha,
+                                      rng=RandomStreams(seed).sequence('two_sample_bootstrap', metric))
+    return summary
+
+
+def stage_plots(ctr_bootstrap, cr_bootstrap):
+    fig, axes = plt.subplots(1, 2, figsize=(12, 4))
+    for ax, (metric, summary) in zip(axes, [('CTR', ctr_bootstrap), ('CR', cr_bootstrap)]):
+        diff = summary.loc['difference']
+        ax.errorbar(x=[0], y=[diff['estimate']], yerr=[[diff['estimate'] - diff['ci_low']], [diff['ci_high'] - diff['estimate']]],
+                    fmt='o', color='black', capsize=5)
+        ax.axhline(0, color='red', linestyle='--')
+        ax.set_xticks([0], [f'{metric}: Test - Control'])
+        ax.set_title(f'Bootstrap CI of the {metric} Difference')
+        ax.grid(True)
+    plt.tight_layout()
+    return fig
+
+
+def build_analysis_pipeline(metrics=('CTR', 'CR'), max_workers=4, profiler=None):
+    stages = [
+        Stage('load', stage_load, ['control_path', 'test_path'], ['control_raw', 'test_raw'], watch=file_signatures),
+        Stage('clean', stage_clean, ['control_raw', 'test_raw', 'imputation_method'], ['control', 'test']),
+        Stage('metrics', stage_metrics, ['control', 'test'], 'metrics'),
+    ]
+    for metric in metrics:
+        key = metric.lower()
+        stages += [
+            Stage(f'{key}_tests', functools.partial(stage_tests, metric=metric), ['metrics'], f'{key}_tests'),
+            Stage(f'{key}_effect_size', functools.partial(stage_effect_size, metric=metric), ['metrics'], f'{key}_effect_size'),
+            Stage(f'{key}_power', stage_power, {'effect_size': f'{key}_effect_size', 'metrics': 'metrics', 'alpha': 'alpha'},
+                  f'{key}_power'),
+            Stage(f'{key}_bootstrap', functools.partial(stage_bootstrap, metric=metric),
+                  ['metrics', 'n_bootstrap', 'alpha', 'seed'], f'{key}_bootstrap'),
+        ]
+    stages.append(Stage('plots', stage_plots, ['ctr_bootstrap', 'cr_bootstrap'], 'figure', concurrent=False))
+    return Pipeline(stages, max_workers=max_workers, profiler=profiler)
+
+# In[ ]:
+
+
+# First run executes every stage; the CTR and CR branches run concurrently
+analysis_pipeline = build_analysis_pipeline()
+pipeline_params = dict(control_path='./control_group.csv', test_path='./test_group.csv', imputation_method='interpolate',
+                       alpha=alpha, n_bootstrap=n_bootstrap, seed=ANALYSIS_SEED)
+pipeline_results = analysis_pipeline.run(**pipeline_params)
+plt.show()
+first_run = list(analysis_pipeline.last_run)
+
+# Unchanged inputs: nothing reruns. A new bootstrap size: only the bootstrap stages and the plots rerun.
+analysis_pipeline.run(**pipeline_params)
+unchanged_run = list(analysis_pipeline.last_run)
+analysis_pipeline.run(n_bootstrap=2000)
+bootstrap_change_run = list(analysis_pipeline.last_run)
+
+first_run, unchanged_run, bootstrap_change_run
+
+# ### Out-of-Core Aggregation over Partitioned Exports
+# 
+# In production the exports arrive as one CSV per campaign and day, thousands of files in the `control_group.csv` / `test_group.csv` schema. Concatenating them into one DataFrame does not fit in memory. The tests in this notebook do not need the raw rows, though. Welch's t-test, the power analysis and the ratio metrics only need counts, sums and sums of squares. `scan_partitions` reduces every file to these sufficient statistics:
+# 
+# - Each file is read on a worker thread and reduced to one row per `(campaign, variant, date)`: the row count, the sum of every funnel column, and count / sum / sum of squares of the derived CTR and CR. The variant is the `Control` / `Test` word in the campaign name, and the remaining name is the campaign. A row whose campaign name has neither word raises a `ValueError` instead of silently dropping out of the sums.
+# - Partial results are merged with a grouped sum every `merge_every` files, so memory stays bounded by the number of distinct keys, not the number of files.
+# - `group_moments` collapses the aggregates to mean and variance per `(campaign, variant)`. `aggregate_tests` then feeds them to `welch_ttest_from_stats` and `TTestIndPower`, the same tests as above, without touching a raw row again.
+
+# In[ ]:
+
+
+import glob
+from concurrent.futures import as_completed
+
+AGGREGATE_KEYS = ['campaign', 'variant', 'date']
+VARIANTS = ('Control', 'Test')
+
+
+def split_campaign_name(names):
+    # 'Control Campaign' -> ('Campaign', 'Control'); the variant word may appear anywhere in the name
+    names = pd.Series(names, dtype=object)
+    variant = names.str.extract(f"\\b({'|'.join(VARIANTS)})\\b", expand=False)
+    campaign = names.str.replace(f"\\b({'|'.join(VARIANTS)})\\b", '', regex=True).str.split().str.join(' ')
+    return campaign, variant
+
+
+def frame_sufficient_stats(frame, metrics=('CTR', 'CR')):
+    campaign, variant = split_campaign_name(frame['Campaign Name'])
+    if variant.isna().any():
+        unassigned = frame['Campaign Name'][variant.isna().to_numpy()]
+        raise ValueError(f"{len(unassigned)} rows have no {' / '.join(VARIANTS)} variant in their campaign name: "
+                         f"{sorted(unassigned.astype(str).unique())}")
+    derived = DerivedMetrics(frame).derive_all(list(metrics))
+
+    stats = pd.DataFrame({'campaign': campaign.to_numpy(), 'variant': variant.to_numpy(),
+                          'date': parse_campaign_dates(frame['Date']), 'rows': 1})
+    for column in FUNNEL_COLUMNS:
+        stats[f'sum {column}'] = frame[column].fillna(0).to_numpy()
+    for metric, values in derived.items():
+        valid = ~np.isnan(values)
+        stats[f'{metric} n'] = valid.astype(np.int64)
+        stats[f'{metric} sum'] = np.where(valid, values, 0.0)
+        stats[f'{metric} sumsq'] = np.where(valid, values, 0.0) ** 2
+    return stats.groupby(AGGREGATE_KEYS, sort=False).sum()
+
+
+def partition_sufficient_stats(path, metrics=('CTR', 'CR')):
+    return frame_sufficient_stats(pd.read_csv(path, delimiter=';'), metrics)
+
+
+def merge_sufficient_stats(partials):
+    return pd.concat(partials).groupby(level=AGGREGATE_KEYS).sum().sort_index()
+
+
+def scan_partitions(paths, max_workers=8, merge_every=256, metrics=('CTR', 'CR')):
+    merged, pending = None, []
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        futures = [pool.submit(partition_sufficient_stats, path, metrics) for path in paths]
+        for future in as_completed(futures):
+            pending.append(future.result())
+            if len(pending) >= merge_every:
+                merged = merge_sufficient_stats(([] if merged is None else [merged]) + pending)
+                pending = []
+    return merge_sufficient_stats(([] if merged is None else [merged]) + pending)
+
+
+def group_moments(aggregates, metrics=('CTR', 'CR')):
+    # Per (campaign, variant): number of days, mean and sample variance of each daily metric
+    totals = aggregates.groupby(level=['campaign', 'variant']).sum()
+    moments = {}
+    for metric in metrics:
+        n, s, ss = totals[f'{metric} n'], totals[f'{metric} sum'], totals[f'{metric} sumsq']
+        moments[(metric, 'n')] = n
+        moments[(metric, 'mean')] = s / n
+        moments[(metric, 'var')] = (ss - s ** 2 / n) / (n - 1)
+    return pd.DataFrame(moments)
+
+
+def aggregate_tests(moments, metrics=('CTR', 'CR'), alpha=0.05):
+    rows = {}
+    for campaign in moments.index.get_level_values('campaign').unique():
+        control, test = moments.loc[(campaign, 'Control')], moments.loc[(campaign, 'Test')]
+        for metric in metrics:
+            n_c, mean_c, var_c = control[(metric, 'n')], control[(metric, 'mean')], control[(metric, 'var')]
+            n_t, mean_t, var_t = test[(metric, 'n')], test[(metric, 'mean')], test[(metric, 'var')]
+            welch = welch_ttest_from_stats(n_c, mean_c, var_c, n_t, mean_t, var_t, alpha=alpha)
+            t_stat, p_value = float(welch['t_stat']), float(welch['p_value'])
+            pooled_std = np.sqrt(((n_c - 1) * var_c + (n_t - 1) * var_t) / (n_c + n_t - 2))
+            d = (mean_c - mean_t) / pooled_std
+            rows[(campaign, metric)] = {
+                'welch_t': t_stat, 'p_value': p_value, 'cohens_d': d,
+                'power': power_analysis.power(effect_size=abs(d), nobs1=n_c, alpha=alpha, ratio=n_t / n_c),
+            }
+    return pd.DataFrame(rows).T.rename_axis(['campaign', 'metric'])
+
+# In[ ]:
+
+
+# Simulate the production layout: split both exports into one file per campaign and day.
+# The partitions live in a temporary directory that is removed once they have been scanned.
+with tempfile.TemporaryDirectory(prefix='ab_partitions_') as partition_dir:
+    for source in ['./control_group.csv', './test_group.csv']:
+        export = pd.read_csv(source, delimiter=';')
+        for _, day in export.groupby('Date', sort=False):
+            variant = day['Campaign Name'].iloc[0].split()[0].lower()
+            day.to_csv(os.path.join(partition_dir, f"{variant}_{day['Date'].iloc[0]}.csv"), sep=';', index=False)
+
+    partition_paths = sorted(glob.glob(os.path.join(partition_dir, '*.csv')))
+    campaign_aggregates = scan_partitions(partition_paths)
+campaign_moments = group_moments(campaign_aggregates)
+aggregate_results = aggregate_tests(campaign_moments, alpha=alpha)
+
+len(partition_paths), campaign_aggregates.memory_usage(deep=True).sum(), aggregate_results
+
+# - The 60 daily partitions reduce to about 8 KB of aggregates. Welch's t-test from these aggregates reproduces the CTR result above exactly (t = -3.98, p = 0.00034), because the missing control day is simply absent from the sums.
+
+# ### Local HTTP Analysis Service
+# 
+# Marketers re-run this analysis by hand in Jupyter every time a new day of data lands. `AnalysisService` keeps the state warm in one local process instead. It uses only the standard library (`asyncio`) plus the stack already used here:
+# 
+# - **Warm state**: the sufficient statistics from the out-of-core stage, seeded from the exports. `POST /rows` accepts new daily rows in the export schema, reduces them to sufficient statistics, and merges them in. Nothing is re-read from disk.
+# - **Endpoints** (JSON):
+#   - `GET /results[?alpha=0.05]`: Welch test, Cohen's d and power per campaign and metric
+#   - `GET /ci?metric=CTR&alpha=0.05`: Welch CI of the test − control difference
+#   - `GET /sample-size?metric=CR&power=0.8&alpha=0.05[&effect=0.2]`: days per group needed
+#   - `GET /metrics`: request count and p50/p95/p99/max latency per endpoint; requests to any other path share one `unknown` entry
+# - **Errors**: `alpha` and `power` outside (0, 1), a non-positive `effect`, unknown metrics and malformed bodies get `400`. Unknown paths get `404`, and any other failure gets `500` with the exception in the body, so every request receives a response.
+# - **Shared computations**: results are memoised per `(endpoint, parameters, data version)`. Concurrent identical requests await the same in-flight task instead of computing again. New rows bump the data version and drop the memoised results of older versions. Computations run in a worker thread, so the event loop keeps accepting requests.
+# 
+# The service is not started when the notebook runs top to bottom. The demo below starts it on a free local port in a background thread, sends a few requests and stops it. For a long-running service, call `serve_analysis(port=8050)`.
+
+# In[ ]:
+
+
+import asyncio
+import collections
+import math
+import urllib.error
+import urllib.parse
+import urllib.request
+
+SERVICE_ENDPOINTS = ('/results', '/ci', '/sample-size', '/metrics', '/rows')
+
+
+def _query_probability(query, name, default):
+    # alpha and power must be probabilities strictly between 0 and 1
+    value = float(query.get(name, default))
+    if not 0 < value < 1:
+        raise ValueError(f'{name} must lie in (0, 1), got {value}')
+    return value
+
+
+def _json_ready(value):
+    # numpy scalars -> Python, non-finite floats -> null, tuple keys -> 'a/b'
+    if isinstance(value, dict):
+        return {('/'.join(map(str, k)) if isinstance(k, tuple) else str(k)): _json_ready(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple, np.ndarray)):
+        return [_json_ready(v) for v in value]
+    if isinstance(value, np.generic):
+        value = value.item()
+    if isinstance(value, float) and not math.isfinite(value):
+        return None
+    return value
+
+
+class AnalysisService:
+    def __init__(self, aggregates, metrics=('CTR', 'CR'), alpha=0.05):
+        self.aggregates = aggregates
+        self.metrics = tuple(metrics)
+        self.alpha = alpha
+        self.version = 0
+        self._results = {}
+        self._in_flight = {}
+        self._latencies = collections.defaultdict(lambda: collections.deque(maxlen=10_000))
+        self._server = None
+        self._loop = None
+
+    # ---- computations (run in a worker thread) ----
+    def _moments(self):
+        return group_moments(self.aggregates, self.metrics)
+
+    def compute_results(self, alpha):
+        results = aggregate_tests(self._moments(), self.metrics, alpha=alpha)
+        return {f'{campaign}/{metric}': row.to_dict() for (campaign, metric), row in results.iterrows()}
+
+    def compute_ci(self, metric, alpha):
+        # One vectorized Welch computation across all campaigns
+        moments = self._moments()[metric]
+        control = moments.xs('Control', level='variant')
+        test = moments.xs('Test', level='variant').reindex(control.index)
+        welch = welch_ttest_from_stats(test['n'], test['mean'], test['var'],
+                                       control['n'], control['mean'], control['var'], alpha=alpha)
+        return {campaign: {field: welch[field][i] for field in ('difference', 'ci_low', 'ci_high', 'df')}
+                for i, campaign in enumerate(control.index)}
+
+    def compute_sample_size(self, metric, power, alpha, effect=None):
+        out = {}
+        results = aggregate_tests(self._moments(), [metric], alpha=alpha)
+        for (campaign, _), row in results.iterrows():
+            d = abs(row['cohens_d']) if effect is None else effect
+            out[campaign] = {'effect_size': d,
+                             'days_per_group': solve_power(effect_size=d, power=power, alpha=alpha, ratio=1.0)}
+        return out
+
+    def add_rows(self, rows):
+        frame = pd.DataFrame(rows)
+        self.aggregates = merge_sufficient_stats([self.aggregates, frame_sufficient_stats(frame, self.metrics)])
+        self.version += 1
+        return {'rows_added': len(frame), 'version': self.version}
+
+    # ---- request handling ----
+    async def _shared(self, key, func, *args):
+        # Memoised per data version; concurrent identical requests await the same task
+        key = (key, self.version)
+        if key in self._results:
+            return self._results[key]
+        if key not in self._in_flight:
+            loop = asyncio.get_running_loop()
+            self._in_flight[key] = loop.run_in_executor(None, func, *args)
+        try:
+            result = await self._in_flight[key]
+        finally:
+            self._in_flight.pop(key, None)
+        if key[1] == self.version:  # rows may have landed while this was computing
+            self._results[key] = result
+        return result
+
+    def _prune_results(self):
+        # Results of older data versions can never be served again
+        self._results = {key: value for key, value in self._results.items() if key[1] == self.version}
+
+    def latency_report(self):
+        report = {}
+        for endpoint, samples in self._latencies.items():
+            ms = np.asarray(samples) * 1000
+            report[endpoint] = {'count': len(ms), 'p50_ms': np.percentile(ms, 50), 'p95_ms': np.percentile(ms, 95),
+                                'p99_ms': np.percentile(ms, 99), 'max_ms': ms.max()}
+        return report
+
+    async def dispatch(self, method, path, query, body):
+        metric = query.get('metric', self.metrics[0])
+        alpha_ = _query_probability(query, 'alpha', self.alpha)
+        if method == 'GET' and path == '/results':
+            return 200, await self._shared(('results', alpha_), self.compute_results, alpha_)
+        if method == 'GET' and path == '/ci':
+            return 200, await self._shared(('ci', metric, alpha_), self.compute_ci, metric, alpha_)
+        if method == 'GET' and path == '/sample-size':
+            power = _query_probability(query, 'power', 0.8)
+            effect = float(query['effect']) if 'effect' in query else None
+            if effect is not None and not effect > 0:
+                raise ValueError(f'effect must be positive, got {effect}')
+            return 200, await self._shared(('sample-size', metric, power, alpha_, effect),
+                                           self.compute_sample_size, metric, power, alpha_, effect)
+        if method == 'GET' and path == '/metrics':
+            return 200, self.latency_report()
+        if method == 'POST' and path == '/rows':
+            payload = json.loads(body or b'[]')
+            rows = payload['rows'] if isinstance(payload, dict) else payload
+            loop = asyncio.get_running_loop()
+            added = await loop.run_in_executor(None, self.add_rows, rows)
+            self._prune_results()
+            return 200, added
+        return 404, {'error': f'No endpoint {method} {path}'}
+
+    async def handle(self, reader, writer):
+        start = time.perf_counter()
+        path = 'invalid'
+        try:
+            request_line = (await reader.readline()).decode('latin-1').split()
+            headers = {}
+            while True:
+                line = (await reader.readline()).decode('latin-1').strip()
+                if not line:
+                    break
+                name, _, value = line.partition(':')
+                headers[name.strip().lower()] = value.strip()
+            body = await reader.readexactly(int(headers.get('content-length', 0)))
+
+            method, target = request_line[0], request_line[1]
+            parsed = urllib.parse.urlsplit(target)
+            path = parsed.path
+            query = dict(urllib.parse.parse_qsl(parsed.query))
+            try:
+                status, payload = await self.dispatch(method, path, query, body)
+            except (KeyError, ValueError) as exc:
+                status, payload = 400, {'error': str(exc)}
+        except (IndexError, asyncio.IncompleteReadError):
+            status, payload = 400, {'error': 'Malformed request'}
+        except Exception as exc:
+            status, payload = 500, {'error': f'{type(exc).__name__}: {exc}'}
+
+        data = json.dumps(_json_ready(payload)).encode()
+        reason = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 500: 'Internal Server Error'}[status]
+        writer.write(f'HTTP/1.1 {status} {reason}\r\nContent-Type: application/json\r\n'
+                     f'Content-Length: {len(data)}\r\nConnection: close\r\n\r\n'.encode() + data)
+        await writer.drain()
+        writer.close()
+        # Known endpoints only, so arbitrary paths cannot grow the latency table
+        self._latencies[path if path in SERVICE_ENDPOINTS else 'unknown'].append(time.perf_counter() - start)
+
+    async def start(self, host='127.0.0.1', port=8050):
+        self._server = await asyncio.start_server(self.handle, host, port)
+        return self._server.sockets[0].getsockname()[1]
+
+    def start_in_thread(self, host='127.0.0.1', port=0):
+        # Run the event loop in a daemon thread, e.g. from a notebook that already has its own loop
+        started = threading.Event()
+        bound = {}
+
+        def run():
+            self._loop = asyncio.new_event_loop()
+            bound['port'] = self._loop.run_until_complete(self.start(host, port))
+            started.set()
+            self._loop.run_forever()
+
+        threading.Thread(target=run, daemon=True).start()
+        started.wait()
+        return bound['port']
+
+    def stop(self):
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._server.close)
+            self._loop.call_soon_threadsafe(self._loop.stop)
+
+
+def serve_analysis(host='127.0.0.1', port=8050, paths=('./control_group.csv', './test_group.csv')):
+    service = AnalysisService(scan_partitions(list(paths)))
+
+    async def main():
+        await service.start(host, port)
+        await asyncio.Event().wait()
+
+    asyncio.run(main())
+
+# In[ ]:
+
+
+# Start the service on a free port, query it, push one new day and query again
+service = AnalysisService(campaign_aggregates, alpha=alpha)
+service_port = service.start_in_thread()
+service_url = f'http://127.0.0.1:{service_port}'
+
+
+def service_request(path, payload=None):
+    data = None if payload is None else json.dumps(payload).encode()
+    with urllib.request.urlopen(urllib.request.Request(service_url + path, data=data)) as response:
+        return json.loads(response.read())
+
+
+# Identical concurrent requests share a single computation
+with ThreadPoolExecutor(max_workers=8) as pool:
+    concurrent_results = list(pool.map(service_request, ['/results'] * 8))
+
+service_ci_before = service_request('/ci?metric=CTR')
+new_day = test_group.iloc[[-1]].assign(Date='31.08.2019').to_dict(orient='records')
+service_request('/rows', new_day)
+service_ci_after = service_request('/ci?metric=CTR')
+service_sample_size = service_request('/sample-size?metric=CR&power=0.8&effect=0.2')
+
+# Invalid parameters are rejected, unknown paths share one latency bucket
+rejected = {}
+for path in ['/sample-size?metric=CR&power=1.5', '/results?alpha=0', '/no-such-endpoint']:
+    try:
+        service_request(path)
+    except urllib.error.HTTPError as exc:
+        rejected[path] = exc.code
+assert rejected == {'/sample-size?metric=CR&power=1.5': 400, '/results?alpha=0': 400, '/no-such-endpoint': 404}
+service_latency = service_request('/metrics')
+assert set(service_latency) <= set(SERVICE_ENDPOINTS) | {'unknown'}
+service.stop()
+
+service_ci_before, service_ci_after, service_sample_size, service_latency
+
+# ### Stage-Level Profiling
+# 
+# It is not obvious which part of a run is slow: CSV parsing, the `summary_stats` build, the pairwise loops in `cliffs_delta_manual`, the power curve, or the bootstrap. `StageProfiler` records per stage:
+# 
+# - **Wall time** (`perf_counter`), **CPU time** of the executing thread (`thread_time`, correct for stages on the pipeline's thread pool), **peak traced memory** (`tracemalloc`) and **row counts**.
+# - **Chrome trace export**: `export_chrome_trace` writes the records as complete (`"ph": "X"`) events, one lane per thread. The file opens in `chrome://tracing` or Perfetto, and concurrent pipeline branches show up side by side.
+# - **cProfile hook**: setting `cprofile_stage` to a stage name runs that stage under `cProfile`; `profile_report()` returns the top functions by cumulative time.
+# 
+# Profiling is opt-in: `PROFILE_STAGES` is read from the `AB_TEST_PROFILE_STAGES` environment variable and is off unless it is `1`. When it is off, `stage()` is a no-op context manager, and the demo below neither runs the timed stages nor writes `./ab_test_stages.trace.json`. Memory tracing slows allocation-heavy code down, so wall times measured with the profiler on are upper bounds. `Pipeline` accepts the profiler through its `profiler` argument.
+
+# In[ ]:
+
+
+import contextlib
+import cProfile
+import io
+import pstats
+import tracemalloc
+
+PROFILE_STAGES = os.environ.get('AB_TEST_PROFILE_STAGES', '0') == '1'
+
+
+class StageProfiler:
+    def __init__(self, enabled=True, cprofile_stage=None):
+        self.enabled = enabled
+        self.cprofile_stage = cprofile_stage
+        self.records = []
+        self._origin = time.perf_counter()
+        self._lock = threading.Lock()
+        self._open = []
+        self._cprofile = None
+        self._owns_tracing = False
+
+    @contextlib.contextmanager
+    def stage(self, name, rows=None):
+        record = {'name': name, 'rows': rows}
+        if not self.enabled:
+            yield record
+            return
+
+        record['peak_bytes'] = 0
+        with self._lock:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+                self._owns_tracing = True
+            # Resetting the process-wide peak would erase it for the stages already open; save it first
+            peak = tracemalloc.get_traced_memory()[1]
+            for open_record in self._open:
+                open_record['peak_bytes'] = max(open_record['peak_bytes'], peak)
+            tracemalloc.reset_peak()
+            self._open.append(record)
+        profiler = cProfile.Profile() if name == self.cprofile_stage else None
+        wall_start, cpu_start = time.perf_counter(), time.thread_time()
+        if profiler is not None:
+            profiler.enable()
+        try:
+            yield record
+        finally:
+            if profiler is not None:
+                profiler.disable()
+                self._cprofile = profiler
+            wall_end, cpu_end = time.perf_counter(), time.thread_time()
+            with self._lock:
+                # The traced peak is process-wide; carry it over to every stage still open
+                peak = tracemalloc.get_traced_memory()[1]
+                for open_record in self._open:
+                    open_record['peak_bytes'] = max(open_record['peak_bytes'], peak)
+                self._open.remove(record)
+                # Tracing slows every allocation; stop it once the last stage we traced has closed
+                if not self._open and self._owns_tracing:
+                    tracemalloc.stop()
+                    self._owns_tracing = False
+                record.update(start_s=wall_start - self._origin, wall_s=wall_end - wall_start,
+                              cpu_s=cpu_end - cpu_start, thread=threading.get_ident())
+                self.records.append(record)
+
+    def summary(self):
+        frame = pd.DataFrame(self.records, columns=['name', 'start_s', 'wall_s', 'cpu_s', 'peak_bytes', 'rows', 'thread'])
+        frame['peak_mb'] = frame['peak_bytes'] / 1024 ** 2
+        return frame.drop(columns=['peak_bytes', 'thread']).sort_values('wall_s', ascending=False).reset_index(drop=True)
+
+    def export_chrome_trace(self, path):
+        threads = {tid: i for i, tid in enumerate(dict.fromkeys(r['thread'] for r in self.records))}
+        events = [{
+            'name': r['name'], 'cat': 'stage', 'ph': 'X', 'pid': os.getpid(), 'tid': threads[r['thread']],
+            'ts': r['start_s'] * 1e6, 'dur': r['wall_s'] * 1e6,
+            'args': {'cpu_ms': r['cpu_s'] * 1e3, 'peak_mb': r['peak_bytes'] / 1024 ** 2, 'rows': r['rows']},
+        } for r in self.records]
+        with open(path, 'w') as fh:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, fh)
+        return path
+
+    def profile_report(self, limit=15, sort='cumulative'):
+        if self._cprofile is None:
+            return ''
+        stream = io.StringIO()
+        pstats.Stats(self._cprofile, stream=stream).sort_stats(sort).print_stats(limit)
+        return stream.getvalue()
+
+
+def build_summary_stats(control, test, metrics=('CTR', 'CR')):
+    # Same table as summary_stats above, built from a loop over metrics and groups
+    rows = {}
+    for metric in metrics:
+        for group, frame in [('Control', control), ('Test', test)]:
+            values = frame[metric]
+            rows[f'{metric} ({group})'] = {
+                'Mean': values.mean(), 'Standard Deviation': values.std(), 'Min': values.min(),
+                '25%': values.quantile(0.25), 'Median': values.median(), '75%': values.quantile(0.75), 'Max': values.max(),
+            }
+    return pd.DataFrame(rows).T.rename_axis('Metric').reset_index()
+
+# In[ ]:
+
+
+# Time the original stages; the cached wrappers are bypassed so the real work is measured.
+# Profiling is opt-in (AB_TEST_PROFILE_STAGES=1), so a normal run neither traces nor writes the trace file.
+if PROFILE_STAGES:
+    stage_profiler = StageProfiler(enabled=PROFILE_STAGES, cprofile_stage='cliffs_delta_manual')
+
+    with stage_profiler.stage('csv_parsing') as record:
+        profiled_control = pd.read_csv('./control_group.csv', delimiter=';')
+        profiled_test = pd.read_csv('./test_group.csv', delimiter=';')
+        record['rows'] = len(profiled_control) + len(profiled_test)
+    with stage_profiler.stage('summary_stats', rows=len(control_group_cleaned) + len(test_group)):
+        build_summary_stats(control_group_cleaned, test_group)
+    with stage_profiler.stage('cliffs_delta_manual', rows=len(control_group_cleaned) * len(test_group)):
+        inspect.unwrap(cliffs_delta_manual)(control_group_cleaned['CR'], test_group['CR'])
+    with stage_profiler.stage('power_curve', rows=len(x_vals)):
+        [power_analysis.power(effect_size=es, nobs1=nobs, alpha=alpha, ratio=1.0) for es in x_vals]
+    with stage_profiler.stage('bootstrap_mean', rows=2 * n_bootstrap):
+        bootstrap_mean(control_group_cleaned['CTR'], n_bootstrap, rng=analysis_streams.stream('bootstrap_mean', 'CTR', 'Control'))
+        bootstrap_mean(test_group['CTR'], n_bootstrap, rng=analysis_streams.stream('bootstrap_mean', 'CTR', 'Test'))
+
+    # A profiled pipeline run adds one record per executed stage, on the thread that ran it.
+    # The result cache is off, so the bootstrap stages do the real work instead of reading the pickles stored above.
+    profiled_pipeline = build_analysis_pipeline(profiler=stage_profiler)
+    analysis_cache.enabled = False
+    try:
+        profiled_pipeline.run(**pipeline_params)
+    finally:
+        analysis_cache.enabled = True
+    plt.close('all')
+
+    stage_trace_path = stage_profiler.export_chrome_trace('./ab_test_stages.trace.json')
+    display(stage_profiler.summary())
+    print(stage_profiler.profile_report(limit=8))
+else:
+    print('Stage profiling is off; set AB_TEST_PROFILE_STAGES=1 to profile the stages')
+
+# - With profiling on, the Python-loop `bootstrap_mean` dominates the run: about 4 seconds for 2 × 10,000 resamples. The vectorized pipeline bootstrap stages, run with the result cache off, take about 0.1 s of wall time and 25 ms of CPU each for the same number of resamples. Everything else, including CSV parsing and the O(n²) `cliffs_delta_manual` at this sample size, is negligible by comparison.
+
+# ## Simulation-Based Power Analysis
+# 
+# `TTestIndPower` assumes normally distributed data. CR fails the Shapiro–Wilk check above and is tested with Mann–Whitney, so `power_cr`, which combines the t-test formula with an assumed `effect_size_cr = 0.2`, describes a test the analysis never runs. Monte Carlo power answers the question for the test that is actually used:
+# 
+# 1. **Simulate from the historical rows.** Each replicate draws `n` control and `n` test days. They come either from the empirical distribution of the observed campaign days (resampling whole rows, so numerator and denominator of a ratio metric stay paired) or from a fitted gamma distribution (moment-matched, for smooth tails).
+# 2. **Apply the effect.** The test arm is the same draw scaled by `1 + lift`. For ratio metrics only the numerator is scaled, e.g. purchases for CR.
+# 3. **Run the chosen test on all replicates at once.** Samples are `(n, replicates)` matrices and every test is vectorized across columns:
+#    - Welch's t-test from column moments.
+#    - Mann–Whitney U with average ranks, tie correction and a continuity-corrected normal approximation. This is scipy's asymptotic method.
+#    - A delta-method z-test for ratio-of-sums metrics, reusing `_delta_ratio`.
+#    - A percentile-bootstrap test of the mean difference, whose resample counts are shared across replicates as a matrix product.
+# 4. **Power is the rejection rate**, with a binomial standard error. Sample sizes are found by bisection over `n`. Each evaluation reuses the same random numbers, so the power-versus-`n` curve is smooth and the search is stable.
+
+# In[ ]:
+
+
+from scipy.stats import rankdata
+
+
+def _simulate_draws(baseline, n, n_sims, lift, distribution, rng):
+    # Control and test draws as (n, n_sims) matrices, or (numerator, denominator) pairs for 2-column baselines
+    baseline = np.asarray(baseline, dtype=np.float64)
+    ratio = baseline.ndim == 2
+    if distribution == 'empirical':
+        rows_c = baseline[rng.integers(0, len(baseline), size=(n, n_sims))]
+        rows_t = baseline[rng.integers(0, len(baseline), size=(n, n_sims))]
+    elif distribution == 'gamma':
+        if ratio:
+            raise ValueError("distribution='gamma' fits a single column; use 'empirical' for ratio metrics")
+        mean, var = baseline.mean(), baseline.var(ddof=1)
+        rows_c = rng.gamma(mean ** 2 / var, var / mean, size=(n, n_sims))
+        rows_t = rng.gamma(mean ** 2 / var, var / mean, size=(n, n_sims))
+    else:
+        raise ValueError(f'Unknown distribution: {distribution!r}')
+    if ratio:
+        return (rows_c[..., 0], rows_c[..., 1]), (rows_t[..., 0] * (1 + lift), rows_t[..., 1])
+    return rows_c, rows_t * (1 + lift)
+
+
+def _welch_reject(control, test, alpha, rng):
+    return welch_ttest_batch(test, control, axis=0, alpha=alpha)['p_value'] < alpha
+
+
+def _mannwhitney_reject(control, test, alpha, rng):
+    n1, n2 = len(control), len(test)
+    pooled = np.concatenate([control, test])
+    n = n1 + n2
+    ranks = rankdata(pooled, axis=0)
+    u1 = ranks[:n1].sum(axis=0) - n1 * (n1 + 1) / 2
+    # Tie term Σ(t³ - t) per column from the runs of equal values in the sorted column
+    ordered = np.sort(pooled, axis=0)
+    run_ids = np.vstack([np.zeros((1, ordered.shape[1]), dtype=np.int64),
+                         np.cumsum(ordered[1:] != ordered[:-1], axis=0)])
+    run_sizes = np.bincount((run_ids + np.arange(ordered.shape[1]) * n).ravel(), minlength=n * ordered.shape[1])
+    ties = (run_sizes ** 3 - run_sizes).reshape(-1, n).sum(axis=1)
+    sigma = np.sqrt(n1 * n2 / 12 * ((n + 1) - ties / (n * (n - 1))))
+    u = np.maximum(u1, n1 * n2 - u1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        p = np.minimum(2 * norm.sf((u - n1 * n2 / 2 - 0.5) / sigma), 1.0)
+    return p < alpha
+
+
+def _ratio_reject(control, test, alpha, rng):
+    ratio_c, var_c = _delta_ratio(*control)
+    ratio_t, var_t = _delta_ratio(*test)
+    z = (ratio_t - ratio_c) / np.sqrt(var_c + var_t)
+    return 2 * norm.sf(np.abs(z)) < alpha
+
+
+def _bootstrap_reject(control, test, alpha, rng, n_bootstrap=500):
+    # Percentile CI of the mean difference; one set of resample counts serves every replicate column
+    counts_c = _resample_counts(rng, len(control), n_bootstrap)
+    counts_t = _resample_counts(rng, len(test), n_bootstrap)
+    diffs = counts_t @ test / len(test) - counts_c @ control / len(control)
+    low, high = np.percentile(diffs, [100 * alpha / 2, 100 * (1 - alpha / 2)], axis=0)
+    return (low > 0) | (high < 0)
+
+
+POWER_TESTS = {
+    'welch': _welch_reject,
+    'mannwhitney': _mannwhitney_reject,
+    'ratio': _ratio_reject,
+    'bootstrap': _bootstrap_reject,
+}
+
+
+def simulate_power(baseline, lift, n, test='mannwhitney', alpha=0.05, n_sims=2000, distribution='empirical',
+                   batch_size=1000, rng=None):
+    rng = np.random.default_rng(rng)
+    reject = POWER_TESTS[test]
+    rejections = 0
+    for start in range(0, n_sims, batch_size):
+        size = min(batch_size, n_sims - start)
+        control, treated = _simulate_draws(baseline, n, size, lift, distribution, rng)
+        rejections += int(reject(control, treated, alpha, rng).sum())
+    power = rejections / n_sims
+    return {'test': test, 'lift': lift, 'n': n, 'power': power, 'se': np.sqrt(power * (1 - power) / n_sims)}
+
+
+def power_curve(baseline, lifts, sizes, test='mannwhitney', alpha=0.05, n_sims=2000, distribution='empirical',
+                rng=None):
+    rng = np.random.default_rng(rng)
+    seed = int(rng.integers(2 ** 63))
+    # Common random numbers: every (lift, n) cell starts from the same seed
+    return pd.DataFrame([simulate_power(baseline, lift, n, test=test, alpha=alpha, n_sims=n_sims,
+                                        distribution=distribution, rng=seed)
+                         for lift in lifts for n in sizes])
+
+
+def simulated_sample_size(baseline, lift, test='mannwhitney', power=0.80, alpha=0.05, n_sims=2000,
+                          distribution='empirical', n_min=5, n_max=2000, rng=None):
+    rng = np.random.default_rng(rng)
+    seed = int(rng.integers(2 ** 63))
+
+    def achieved(n):
+        return simulate_power(baseline, lift, n, test=test, alpha=alpha, n_sims=n_sims,
+                              distribution=distribution, rng=seed)['power']
+
+    if achieved(n_max) < power:
+        return {'test': test, 'lift': lift, 'n': None, 'power': None}
+    low, high = n_min, n_max
+    while low < high:
+        mid = (low + high) // 2
+        if achieved(mid) >= power:
+            high = mid
+        else:
+            low = mid + 1
+    return {'test': test, 'lift': lift, 'n': low, 'power': achieved(low)}
+
+# In[ ]:
+
+
+# Historical control days: the CR column for single-metric tests, (purchases, clicks) rows for the ratio test
+cr_baseline = control_group_imputed['CR'].to_numpy()
+cr_numerator, cr_denominator, _ = METRIC_DEFINITIONS['CR']
+cr_rows = control_group_imputed[[cr_numerator, cr_denominator]].to_numpy(dtype=np.float64)
+cr_lift = effect_size_cr * cr_baseline.std(ddof=1) / cr_baseline.mean()  # the lift that effect_size_cr implies
+
+start = time.perf_counter()
+simulated_power_cr = pd.DataFrame([
+    simulate_power(cr_baseline, cr_lift, nobs, test='welch', rng=analysis_streams.stream('power_sim', 'welch')),
+    simulate_power(cr_baseline, cr_lift, nobs, test='mannwhitney', rng=analysis_streams.stream('power_sim', 'mannwhitney')),
+    simulate_power(cr_baseline, cr_lift, nobs, test='mannwhitney', distribution='gamma',
+                   rng=analysis_streams.stream('power_sim', 'mannwhitney_gamma')),
+    simulate_power(cr_baseline, cr_lift, nobs, test='bootstrap', rng=analysis_streams.stream('power_sim', 'bootstrap')),
+    simulate_power(cr_rows, cr_lift, nobs, test='ratio', rng=analysis_streams.stream('power_sim', 'ratio')),
+], index=['Welch', 'Mann-Whitney', 'Mann-Whitney (gamma fit)', 'Bootstrap', 'Ratio (delta method)'])
+print(f'TTestIndPower for d = {effect_size_cr}: {power_cr:.3f}  (a {cr_lift:.1%} lift in mean CR, n = {nobs})')
+display(simulated_power_cr)
+
+# The same simulations at zero lift give each test's false-positive rate at this sample size
+false_positive_rate_cr = pd.Series({
+    test: simulate_power(cr_baseline, 0.0, nobs, test=test, rng=analysis_streams.stream('false_positive_sim', test))['power']
+    for test in ['welch', 'mannwhitney', 'bootstrap']
+})
+print('False-positive rate at zero lift:', false_positive_rate_cr.round(4).to_dict())
+
+lifts = [0.1, 0.2, 0.3, 0.5]
+sizes = [10, 20, 30, 60, 120, 240]
+cr_power_curves = pd.concat([
+    power_curve(cr_baseline, lifts, sizes, test='mannwhitney', rng=analysis_streams.stream('power_curve', 'mannwhitney')),
+    power_curve(cr_rows, lifts, sizes, test='ratio', rng=analysis_streams.stream('power_curve', 'ratio')),
+], ignore_index=True)
+cr_sample_sizes = pd.DataFrame([
+    simulated_sample_size(cr_baseline, 0.2, test='mannwhitney', rng=analysis_streams.stream('sample_size', 'mannwhitney')),
+    simulated_sample_size(cr_rows, 0.2, test='ratio', rng=analysis_streams.stream('sample_size', 'ratio')),
+])
+print(f'Simulations finished in {time.perf_counter() - start:.1f} s')
+display(cr_sample_sizes)
+
+fig, axes = plt.subplots(1, 2, figsize=(12, 4), sharey=True)
+for ax, (test, curves) in zip(axes, cr_power_curves.groupby('test')):
+    for lift, curve in curves.groupby('lift'):
+        ax.plot(curve['n'], curve['power'], marker='o', label=f'+{lift:.0%}')
+    ax.axhline(0.8, color='grey', linestyle='--', linewidth=1)
+    ax.set_xscale('log')
+    ax.set_title(f'Simulated power for CR ({test})')
+    ax.set_xlabel('Days per group')
+axes[0].set_ylabel('Power')
+axes[0].legend(title='Lift')
+plt.tight_layout()
+plt.show()
+
+# - At the observed 29–30 days per group, every test has roughly 8–14% power to detect the lift implied by `effect_size_cr = 0.2`. The analytic `power_cr` is in the same range, but for a different test. The percentile bootstrap rejects slightly more often partly because it is anti-conservative at this sample size: its simulated false-positive rate at zero lift is about 6.4%, against about 5.2% for Welch and 4.3% for Mann–Whitney.
+# - Detecting a 20% CR lift with 80% power needs about 190 days per group with Mann–Whitney on daily CR. The delta-method ratio test on (purchases, clicks) needs about 130, because it weights days by their click volume.
+# - The gamma fit gives lower Mann–Whitney power than resampling the observed days. That difference shows how sensitive these numbers are to the assumed tail shape.
+
+# ### Minimum Detectable Effect Across the Campaign Portfolio
+# 
+# Planners usually ask the question the other way round: given the traffic a campaign gets, what is the smallest lift a 7-, 14- or 30-day test could detect? The MDE engine inverts power for every (campaign, variant) × metric × horizon in one broadcast:
+# 
+# - **Per-campaign day-level variance** comes from the daily sufficient statistics of the out-of-core stage (`campaign_aggregates`), so any set of exports in the `data/` schema can feed it. Each metric in `METRIC_DEFINITIONS` is a ratio of funnel sums. Its per-day variance is the delta-method variance used by `_delta_ratio`, $\sigma^2_{day} = (s_y^2 - 2 r\, s_{xy} + r^2 s_x^2) / \bar{x}^2$. Day-to-day swings in traffic and rates are therefore included, not just binomial noise.
+# - **Closed-form inversion.** With $h$ days per arm, $\text{MDE} = (t_{1-\alpha/2,\,df} + t_{power,\,df}) \sqrt{2\sigma^2_{day}/h}$ with $df = 2(h-1)$. `stdtrit` broadcasts this over a `(groups, metrics, horizons)` array. Results are reported relative to the current ratio by default.
+# - **Planned traffic.** `daily_traffic` overrides the historical daily impressions per group; days without traffic (such as the zero-filled missing control day) are left out of the historical mean. Only part of $\sigma^2_{day}$ shrinks with volume. For the proportion metrics in `PROPORTION_METRICS` (CTR, CR), the binomial part $r(1-r)/\bar{x}$ is scaled by historical / planned traffic. The remainder is real day-to-day variation of the rate and stays as it is. Cost ratios are left unscaled, because more traffic does not make daily spend per click less volatile.
+# - **Caching and incremental refresh.** `PortfolioMDE` memoises tables per data version and parameters. `add_days` merges newly landed daily aggregates and recomputes the moments only for the (campaign, variant) groups those days touch.
+
+# In[ ]:
+
+
+MDE_HORIZONS = (7, 14, 30)
+PROPORTION_METRICS = ('CTR', 'CR')  # numerator events are a subset of the denominator events
+
+
+def daily_ratio_moments(aggregates, metrics=tuple(METRIC_DEFINITIONS)):
+    # Per (campaign, variant): days, current ratio, mean daily denominator, per-day delta-method variance
+    # and its binomial part (zero for metrics that are not proportions)
+    keys = ['campaign', 'variant']
+    impressions = aggregates['sum # of Impressions']
+    moments = {('traffic', 'daily_impressions'): impressions.where(impressions > 0).groupby(level=keys).mean()}
+    for metric in metrics:
+        numerator, denominator, scale = METRIC_DEFINITIONS[metric]
+        x, y = aggregates[f'sum {denominator}'], aggregates[f'sum {numerator}']
+        valid = (x > 0).to_numpy()
+        daily = pd.DataFrame({'n': 1, 'x': x, 'y': y, 'xx': x * x, 'yy': y * y, 'xy': x * y})[valid]
+        sums = daily.groupby(level=keys).sum()
+        n = sums['n']
+        mean_x, mean_y = sums['x'] / n, sums['y'] / n
+        var_x = (sums['xx'] - n * mean_x ** 2) / (n - 1)
+        var_y = (sums['yy'] - n * mean_y ** 2) / (n - 1)
+        cov = (sums['xy'] - n * mean_x * mean_y) / (n - 1)
+        ratio = sums['y'] / sums['x']
+        moments[(metric, 'days')] = n
+        moments[(metric, 'ratio')] = ratio * scale
+        moments[(metric, 'daily_denominator')] = mean_x
+        moments[(metric, 'daily_var')] = (var_y - 2 * ratio * cov + ratio ** 2 * var_x) / mean_x ** 2 * scale ** 2
+        binomial = ratio * (1 - ratio) / mean_x * scale ** 2
+        moments[(metric, 'binomial_var')] = binomial if metric in PROPORTION_METRICS else 0.0 * binomial
+    return pd.DataFrame(moments)
+
+
+def portfolio_mde(moments, metrics=tuple(METRIC_DEFINITIONS), horizons=MDE_HORIZONS, alpha=0.05, power=0.80,
+                  daily_traffic=None, relative=True):
+    metrics = list(metrics)
+    horizons = np.asarray(horizons, dtype=np.float64)
+    var = np.column_stack([moments[(metric, 'daily_var')].to_numpy() for metric in metrics])  # (groups, metrics)
+    if daily_traffic is not None:
+        # Only the binomial part shrinks with volume; between-day variation of the rate does not
+        binomial = np.column_stack([moments[(metric, 'binomial_var')].to_numpy() for metric in metrics])
+        historical = moments[('traffic', 'daily_impressions')]
+        planned = pd.Series(daily_traffic, dtype=np.float64).reindex(moments.index).fillna(historical)
+        binomial = np.minimum(binomial, var)
+        var = var - binomial + binomial * (historical / planned).to_numpy()[:, None]
+
+    df = 2 * (horizons - 1)
+    multiplier = stdtrit(df, 1 - alpha / 2) + stdtrit(df, power)  # (horizons,)
+    mde = multiplier * np.sqrt(2 * var[:, :, None] / horizons)  # (groups, metrics, horizons)
+    if relative:
+        mde = mde / np.column_stack([moments[(metric, 'ratio')].to_numpy() for metric in metrics])[:, :, None]
+
+    index = pd.MultiIndex.from_tuples([(*group, metric) for group in moments.index for metric in metrics],
+                                      names=['campaign', 'variant', 'metric'])
+    return pd.DataFrame(mde.reshape(len(index), len(horizons)), index=index,
+                        columns=[f'{int(h)} days' for h in horizons])
+
+
+class PortfolioMDE:
+    def __init__(self, aggregates, metrics=tuple(METRIC_DEFINITIONS)):
+        self.metrics = list(metrics)
+        self.aggregates = aggregates
+        self.moments = daily_ratio_moments(aggregates, self.metrics)
+        self.version = 0
+        self._results = {}
+
+    def add_days(self, new_aggregates):
+        # Merge newly landed (campaign, variant, date) rows; only the groups they touch are recomputed
+        self.aggregates = merge_sufficient_stats([self.aggregates, new_aggregates])
+        touched = new_aggregates.index.droplevel('date').unique()
+        in_touched = self.aggregates.index.droplevel('date').isin(touched)
+        fresh = daily_ratio_moments(self.aggregates[in_touched], self.metrics)
+        self.moments = pd.concat([self.moments[~self.moments.index.isin(touched)], fresh]).sort_index()
+        self.version += 1
+        self._results.clear()
+        return touched
+
+    def mde(self, horizons=MDE_HORIZONS, alpha=0.05, power=0.80, daily_traffic=None, relative=True):
+        key = fingerprint((self.version, tuple(horizons), alpha, power, daily_traffic, relative))
+        if key not in self._results:
+            self._results[key] = portfolio_mde(self.moments, self.metrics, horizons, alpha=alpha, power=power,
+                                               daily_traffic=daily_traffic, relative=relative)
+        return self._results[key]
+
+# In[ ]:
+
+
+mde_planner = PortfolioMDE(campaign_aggregates)
+relative_mde = mde_planner.mde(alpha=alpha)
+display((100 * relative_mde).round(1).add_suffix(' (MDE %)'))
+
+# Planned traffic: twice the historical daily impressions for the Test arm
+doubled = {('Campaign', 'Test'): 2 * mde_planner.moments.loc[('Campaign', 'Test'), ('traffic', 'daily_impressions')]}
+print(mde_planner.mde(alpha=alpha, daily_traffic=doubled).loc[('Campaign', 'Test', 'CR')].round(4).to_dict())
+binomial_share = (mde_planner.moments.xs('binomial_var', axis=1, level=1)
+                  / mde_planner.moments.xs('daily_var', axis=1, level=1))[list(PROPORTION_METRICS)]
+print('Binomial share of the daily variance:', binomial_share.round(4).to_dict('index'))
+
+# A new day lands for the test arm: only that group is recomputed and the cached tables are invalidated
+landed = frame_sufficient_stats(test_group.iloc[[-1]].assign(Date='31.08.2019'), metrics=())
+print('Recomputed groups:', list(mde_planner.add_days(landed)))
+print('Test CR 30-day MDE after refresh:', round(mde_planner.mde(alpha=alpha).loc[('Campaign', 'Test', 'CR'), '30 days'], 4))
+
+# Portfolio scale: 10,000 synthetic campaigns × 7 metrics × 3 horizons in one broadcast
+synthetic_moments = pd.concat([mde_planner.moments] * 5000)
+synthetic_moments.index = pd.MultiIndex.from_product([[f'Campaign {i}' for i in range(5000)], list(VARIANTS)],
+                                                     names=['campaign', 'variant'])
+start = time.perf_counter()
+synthetic_mde = portfolio_mde(synthetic_moments, alpha=alpha)
+print(f'{len(synthetic_mde):,} (group, metric) rows × {synthetic_mde.shape[1]} horizons in {time.perf_counter() - start:.3f} s')
+
+# - Day-level volatility is high, so even a 30-day test can only detect relative changes of roughly 16–40%, depending on the metric and arm. CPM (16%) and cost per reach (19.5%) on the control arm are the most detectable. The least detectable are CR on the control arm (40.1%) and CTR and cost per reach on the test arm (about 40%). The test arm's CR is at 33.3%. The CR figure matches the simulation above: a 20% lift needs about 130 days per group.
+# - Doubling the test arm's daily traffic barely moves its 30-day CR MDE (33.3% to 33.2%). Binomial noise is under 1% of the daily CTR and CR variance at tens of thousands of impressions a day. The MDE is limited by day-to-day swings in the rates, so the fix is more days, not more traffic per day. The refresh after a new day touches only the test group's moments.
+
+# ### Per-User Event Ingestion
+# 
+# Everything so far works on the day-level exports. Production logs are per event: one row per impression, click or purchase, with a user id and a variant. `EventAggregator` streams such logs into compact integer-coded counts and never builds a DataFrame of the whole log:
+# 
+# - **Integer coding.** Each chunk of the CSV (columns `date`, `user_id`, `variant`, `event`) is mapped to codes. Event types and variants have fixed vocabularies (`EVENT_TYPES`, `VARIANTS`). User ids and dates get growing vocabularies (`pd.Index.get_indexer`), so every user is a row number. Rows with an unknown event type or variant are counted and dropped.
+# - **`bincount` reductions.** One `np.bincount` over `user × event` codes adds each chunk's events into an `(users, 3)` count matrix. A second one over `variant × day × event` fills a `(2, days, 3)` cube. Only these counts and the vocabularies outlive the chunk.
+# - **Exposure check.** A per-user `(users, 2)` flag matrix records which arms each user was exposed to. Users seen in both arms are excluded from the per-user outputs and reported, because they break the independence the tests assume.
+# - **Same downstream tests.**
+#   - `per_user(variant)` returns per-user counts with the export's funnel column names, so `DerivedMetrics`, `welch_ttest_batch`, `mannwhitneyu`, `_delta_ratio` and the streaming `PoissonBootstrap` apply unchanged. `two_sample_bootstrap` is not used here because its Cliff's delta builds an n × n sign matrix, which is too large for tens of thousands of users.
+#   - `per_day()` returns rows in the campaign export schema (`Campaign Name`, `Date` and funnel columns) for the day-level stages.
+
+# In[ ]:
+
+
+EVENT_TYPES = ('impression', 'click', 'purchase')
+EVENT_COLUMNS = {'impression': '# of Impressions', 'click': '# of Website Clicks', 'purchase': '# of Purchase'}
+EVENT_LOG_COLUMNS = ['date', 'user_id', 'variant', 'event']
+
+
+def _grow(counts, size, axis=0):
+    # Zero-pad a count array along an axis when new vocabulary entries appear
+    missing = size - counts.shape[axis]
+    if missing <= 0:
+        return counts
+    pad = [(0, 0)] * counts.ndim
+    pad[axis] = (0, missing)
+    return np.pad(counts, pad)
+
+
+class EventAggregator:
+    def __init__(self):
+        self.users = pd.Index([], dtype=object)
+        self.dates = pd.Index([], dtype=object)
+        self.user_counts = np.zeros((0, len(EVENT_TYPES)), dtype=np.int32)
+        self.user_exposure = np.zeros((0, len(VARIANTS)), dtype=bool)
+        self.day_counts = np.zeros((len(VARIANTS), 0, len(EVENT_TYPES)), dtype=np.int64)
+        self.events = 0
+        self.dropped = 0
+
+    def _encode(self, name, values):
+        vocabulary = getattr(self, name)
+        codes = vocabulary.get_indexer(values)
+        new = codes < 0
+        if new.any():
+            vocabulary = vocabulary.append(pd.Index(pd.unique(values[new])))
+            setattr(self, name, vocabulary)
+            codes[new] = vocabulary.get_indexer(values[new])
+        return codes
+
+    def update(self, dates, user_ids, variants, events):
+        event_codes = pd.Index(EVENT_TYPES).get_indexer(events)
+        variant_codes = pd.Index(VARIANTS).get_indexer(variants)
+        keep = (event_codes >= 0) & (variant_codes >= 0)
+        self.dropped += int((~keep).sum())
+        event_codes, variant_codes = event_codes[keep], variant_codes[keep]
+        user_codes = self._encode('users', np.asarray(user_ids, dtype=object)[keep])
+        day_codes = self._encode('dates', np.asarray(dates, dtype=object)[keep])
+
+        n_users, n_days, n_types, n_variants = len(self.users), len(self.dates), len(EVENT_TYPES), len(VARIANTS)
+        self.user_counts = _grow(self.user_counts, n_users) + np.bincount(
+            user_codes * n_types + event_codes, minlength=n_users * n_types).reshape(n_users, n_types).astype(np.int32)
+        self.user_exposure = _grow(self.user_exposure, n_users) | (np.bincount(
+            user_codes * n_variants + variant_codes, minlength=n_users * n_variants).reshape(n_users, n_variants) > 0)
+        self.day_counts = _grow(self.day_counts, n_days, axis=1) + np.bincount(
+            (variant_codes * n_days + day_codes) * n_types + event_codes,
+            minlength=n_variants * n_days * n_types).reshape(n_variants, n_days, n_types)
+        self.events += len(event_codes)
+        return self
+
+    @property
+    def mixed_users(self):
+        return int((self.user_exposure.sum(axis=1) > 1).sum())
+
+    @property
+    def nbytes(self):
+        return self.user_counts.nbytes + self.user_exposure.nbytes + self.day_counts.nbytes
+
+    def per_user(self, variant):
+        # Counts for users exposed to this arm only
+        only = self.user_exposure[:, VARIANTS.index(variant)] & (self.user_exposure.sum(axis=1) == 1)
+        return pd.DataFrame(self.user_counts[only], index=self.users[only],
+                            columns=[EVENT_COLUMNS[event] for event in EVENT_TYPES])
+
+    def per_day(self):
+        order = np.argsort(parse_campaign_dates(self.dates))
+        frames = []
+        for variant_code, variant in enumerate(VARIANTS):
+            frame = pd.DataFrame(self.day_counts[variant_code][order],
+                                 columns=[EVENT_COLUMNS[event] for event in EVENT_TYPES])
+            frame.insert(0, 'Date', self.dates[order])
+            frame.insert(0, 'Campaign Name', f'{variant} Campaign')
+            frames.append(frame)
+        return pd.concat(frames, ignore_index=True)
+
+
+def stream_event_log(path, chunksize=200_000, aggregator=None):
+    aggregator = EventAggregator() if aggregator is None else aggregator
+    for chunk in pd.read_csv(path, usecols=EVENT_LOG_COLUMNS, dtype=str, chunksize=chunksize):
+        aggregator.update(*(chunk[column].to_numpy() for column in EVENT_LOG_COLUMNS))
+    return aggregator
+
+# In[ ]:
+
+
+# Synthetic event log with the campaigns' funnel rates: per-user impression counts and click propensities vary,
+# a few control users also leak into the test arm. Writing the fixture is the only place a per-event frame exists.
+def write_synthetic_event_log(path, users_per_variant=20_000, mean_impressions=8.0, rng=None):
+    rng = np.random.default_rng(rng)
+    dates = control_group_imputed['Date'].dt.strftime('%d.%m.%Y').to_numpy()
+    totals = {'Control': control_group_imputed, 'Test': test_group_imputed}
+    parts = []
+    for variant, frame in totals.items():
+        ctr = frame['# of Website Clicks'].sum() / frame['# of Impressions'].sum()
+        cr = frame['# of Purchase'].sum() / frame['# of Website Clicks'].sum()
+        user_ids = np.array([f'{variant[0].lower()}{i:06d}' for i in range(users_per_variant)], dtype=object)
+        impressions = rng.poisson(rng.gamma(2.0, mean_impressions / 2.0, size=users_per_variant))
+        clicks = rng.binomial(impressions, np.minimum(ctr * rng.gamma(4.0, 0.25, size=users_per_variant), 1.0))
+        purchases = rng.binomial(clicks, cr)
+        for event, counts in zip(EVENT_TYPES, (impressions, clicks, purchases)):
+            users = np.repeat(user_ids, counts)
+            parts.append(pd.DataFrame({'date': rng.choice(dates, size=len(users)), 'user_id': users,
+                                       'variant': variant, 'event': event}))
+    leaked = pd.DataFrame({'date': dates[0], 'user_id': [f'c{i:06d}' for i in range(25)],
+                           'variant': 'Test', 'event': 'impression'})
+    log = pd.concat(parts + [leaked], ignore_index=True)
+    log.iloc[rng.permutation(len(log))].to_csv(path, index=False)
+    return len(log)
+
+
+# The log lives in its own temporary directory, removed once it has been ingested
+with tempfile.TemporaryDirectory(prefix='ab_events_') as event_dir:
+    event_log_path = os.path.join(event_dir, 'events.csv')
+    n_logged = write_synthetic_event_log(event_log_path, rng=analysis_streams.stream('synthetic_event_log'))
+
+    start = time.perf_counter()
+    event_log = stream_event_log(event_log_path)
+    print(f'{event_log.events:,} of {n_logged:,} events -> {len(event_log.users):,} users, {len(event_log.dates)} days, '
+          f'{event_log.nbytes / 1024:.0f} KB of counts in {time.perf_counter() - start:.2f} s; '
+          f'{event_log.mixed_users} users exposed to both arms excluded')
+
+# Per-user CTR and CR through the existing tests (test - control)
+user_counts = {variant: event_log.per_user(variant) for variant in VARIANTS}
+user_metrics = {variant: DerivedMetrics(frame).derive_all(['CTR', 'CR']) for variant, frame in user_counts.items()}
+user_level_tests = {}
+for metric in ['CTR', 'CR']:
+    control_values, test_values = user_metrics['Control'][metric], user_metrics['Test'][metric]
+    welch = welch_ttest_batch(test_values, control_values, alpha=alpha)
+    _, mw_p = mannwhitneyu(control_values[~np.isnan(control_values)], test_values[~np.isnan(test_values)])
+    numerator, denominator, scale = METRIC_DEFINITIONS[metric]
+    ratios = {variant: _delta_ratio(frame[[numerator]].to_numpy(float), frame[[denominator]].to_numpy(float))
+              for variant, frame in user_counts.items()}
+    # Ratio-of-sums bootstrap with users as the resampling unit, one independent seed per arm
+    boots = {variant: PoissonBootstrap(n_replicates=1000, ratio=True,
+                                       seed=analysis_streams.seed('event_log_bootstrap', metric, variant)).update(
+                 event_log.users.get_indexer(frame.index), frame[numerator].to_numpy(float) * scale,
+                 frame[denominator].to_numpy(float))
+             for variant, frame in user_counts.items()}
+    ratio_diff = boots['Test'].replicates - boots['Control'].replicates
+    user_level_tests[metric] = {
+        'users (control / test)': f"{(~np.isnan(control_values)).sum():,} / {(~np.isnan(test_values)).sum():,}",
+        'mean per-user difference': float(welch['difference']), 'welch_p': float(welch['p_value']),
+        'mannwhitney_p': mw_p,
+        'ratio of sums (control / test)': tuple(round(float(ratios[v][0][0]) * scale, 3) for v in VARIANTS),
+        'ratio difference bootstrap CI': tuple(np.percentile(ratio_diff, [100 * alpha / 2, 100 * (1 - alpha / 2)]).round(3)),
+    }
+display(pd.DataFrame(user_level_tests).T)
+
+# Day-level rows in the export schema: the per-day totals match the per-user totals
+event_days = event_log.per_day()
+assert event_days['# of Impressions'].sum() == event_log.user_counts[:, 0].sum()
+event_day_ctr = {variant: DerivedMetrics(event_days[event_days['Campaign Name'] == f'{variant} Campaign'])['CTR']
+                 for variant in VARIANTS}
+print('Day-level CTR Welch p:', float(welch_ttest_batch(event_day_ctr['Test'], event_day_ctr['Control'])['p_value']))
+
+# - The synthetic log (about 340,000 events from roughly 38,000 users, with the campaigns' funnel rates) is ingested in about a second. Only about 0.5 MB of counts remain, about 14 bytes per user, whatever the number of events.
+# - The 25 control users who leaked into the test arm are detected and excluded from the per-user tests.
+# - At the user level, the CTR difference is unmistakable. For CR, the per-user Welch test (p ≈ 0.001) and the bootstrap CI for the difference in ratio of sums (about −2.4 to −0.7 points) both put the test arm below control, in line with the campaigns' CR of about 10.0% vs 8.5% that the log was generated from. Mann–Whitney does not pick this up (p ≈ 0.49), because most clicking users never purchase and tie at a per-user CR of zero. With thousands of clicking users per arm, the user-level tests resolve a CR gap that the 30 day-level rows of the real exports could not.
+
+# ### Sample-Ratio-Mismatch and Traffic-Balance Monitor
+# 
+# Every comparison above assumes that control and test received traffic in the planned proportions. A broken split, a bot filter that hits only one arm, or a tracking outage makes the arms differ in who they reach. This sample ratio mismatch (SRM) biases every downstream metric, and no test on CTR or CR can detect it. The monitor checks the allocation itself:
+# 
+# - **Tests.** For `# of Impressions` and `Reach`, a chi-square test and a G-test (likelihood ratio, 1 df) compare the control/test counts with the expected control share (50% unless configured). `srm_tests` works on arrays of any shape, so every campaign × day × column is evaluated in one call.
+# - **Per day and overall.** Days on which one arm has no data are reported as `missing arm` rather than tested. The overall test per campaign uses only the days on which both arms reported. Reach is summed over days as a traffic volume, not de-duplicated users. An overall SRM uses `alpha = 0.001`, the usual SRM threshold, since counts in the hundreds of thousands make even tiny imbalances significant.
+# - **Incremental.** `SRMMonitor.update` adds new daily sufficient statistics (the out-of-core aggregates, or `frame_sufficient_stats` of freshly landed rows) into a `(campaign, date) × (column, variant)` count table. The report is re-evaluated lazily, once per data version.
+# - **Guarding the pipeline.** `with_srm_guard` adds an `srm` stage after `load` and makes the power and bootstrap stages wait for it. With `srm_policy='warn'` a mismatch issues a `SampleRatioMismatchWarning` and the run continues. With `'halt'` it raises `SampleRatioMismatchError` before any expensive stage starts.
+
+# In[ ]:
+
+
+import warnings
+
+SRM_COLUMNS = ('# of Impressions', 'Reach')
+
+
+class SampleRatioMismatchError(RuntimeError):
+    pass
+
+
+class SampleRatioMismatchWarning(UserWarning):
+    pass
+
+
+def srm_tests(control, test, expected_share=0.5):
+    # Chi-square and G-test (1 df) of control/test counts against the expected control share, for any array shape
+    control, test = np.asarray(control, dtype=np.float64), np.asarray(test, dtype=np.float64)
+    expected_share = np.asarray(expected_share, dtype=np.float64)
+    total = control + test
+    observed = np.stack([control, test])
+    expected = np.stack([total * expected_share, total * (1 - expected_share)])
+    with np.errstate(divide='ignore', invalid='ignore'):
+        chi_square = ((observed - expected) ** 2 / expected).sum(axis=0)
+        g_stat = 2 * np.where(observed > 0, observed * np.log(observed / expected), 0.0).sum(axis=0)
+        control_share = control / total
+    return {'control_share': control_share, 'chi_square': chi_square, 'chi_square_p': chi2.sf(chi_square, 1),
+            'g_stat': g_stat, 'g_p': chi2.sf(g_stat, 1)}
+
+
+class SRMMonitor:
+    def __init__(self, columns=SRM_COLUMNS, expected_share=0.5, alpha=0.001):
+        self.columns = list(columns)
+        self.expected_share = expected_share
+        self.alpha = alpha
+        self.daily = None
+        self.version = 0
+        self._report = None
+
+    def update(self, aggregates):
+        # Add daily (campaign, variant, date) sufficient statistics into the (campaign, date) x (column, variant) table
+        counts = aggregates[[f'sum {column}' for column in self.columns]].set_axis(self.columns, axis=1)
+        counts = counts.unstack('variant').reindex(columns=pd.MultiIndex.from_product([self.columns, VARIANTS]))
+        self.daily = counts if self.daily is None else self.daily.add(counts, fill_value=0)
+        self.version += 1
+        self._report = None
+        return self
+
+    def report(self):
+        if self._report is not None:
+            return self._report
+        daily = self.daily.fillna(0).sort_index()
+        control = daily.xs('Control', axis=1, level=1)[self.columns].to_numpy()
+        test = daily.xs('Test', axis=1, level=1)[self.columns].to_numpy()
+        both_arms = (control > 0) & (test > 0)
+
+        # Overall per campaign from the days on which both arms reported, per column
+        campaign_codes, campaigns = pd.factorize(daily.index.get_level_values('campaign'))
+        overall_control = np.zeros((len(campaigns), len(self.columns)))
+        overall_test = np.zeros_like(overall_control)
+        np.add.at(overall_control, campaign_codes, np.where(both_arms, control, 0.0))
+        np.add.at(overall_test, campaign_codes, np.where(both_arms, test, 0.0))
+
+        scopes = [
+            (daily.index.get_level_values('campaign'), daily.index.get_level_values('date'), control, test, both_arms),
+            (campaigns, pd.NaT, overall_control, overall_test, np.ones_like(overall_control, dtype=bool)),
+        ]
+        frames = []
+        for campaign, date, control_counts, test_counts, tested in scopes:
+            results = srm_tests(control_counts, test_counts, self.expected_share)
+            for j, column in enumerate(self.columns):
+                frame = pd.DataFrame({'campaign': campaign, 'date': date, 'column': column,
+                                      'control': control_counts[:, j], 'test': test_counts[:, j]})
+                for name, values in results.items():
+                    frame[name] = values[:, j]
+                frame['status'] = np.where(~tested[:, j], 'missing arm',
+                                           np.where(frame['chi_square_p'] < self.alpha, 'SRM', 'ok'))
+                frames.append(frame)
+        self._report = pd.concat(frames, ignore_index=True)
+        return self._report
+
+    def overall(self):
+        return self.report()[lambda frame: frame['date'].isna()].drop(columns='date').reset_index(drop=True)
+
+    def check(self, policy='warn'):
+        flagged = self.overall()[lambda frame: frame['status'] != 'ok']
+        if len(flagged) and policy != 'ignore':
+            message = '; '.join(f"{row.campaign} {row.column}: control share {row.control_share:.1%} "
+                                f"(chi-square p = {row.chi_square_p:.2g})" for row in flagged.itertuples())
+            if policy == 'halt':
+                raise SampleRatioMismatchError(f'Sample ratio mismatch: {message}')
+            warnings.warn(f'Sample ratio mismatch: {message}', SampleRatioMismatchWarning, stacklevel=2)
+        return flagged
+
+
+def stage_srm(control_raw, test_raw, srm_policy, srm_alpha):
+    frame = pd.concat([control_raw, test_raw], ignore_index=True)
+    monitor = SRMMonitor(alpha=srm_alpha).update(frame_sufficient_stats(frame, metrics=()))
+    monitor.check(srm_policy)
+    return monitor.report()
+
+
+def _after_srm(func):
+    # The wrapped stage waits for the SRM check without using its result
+    def guarded(srm_check, **kwargs):
+        return func(**kwargs)
+    return guarded
+
+
+def with_srm_guard(pipeline, guarded_suffixes=('_power', '_bootstrap')):
+    stages = [Stage('srm', stage_srm, ['control_raw', 'test_raw', 'srm_policy', 'srm_alpha'], 'srm_check')]
+    for stage in pipeline.stages.values():
+        if stage.name.endswith(guarded_suffixes):
+            stage = Stage(stage.name, _after_srm(stage.func), {**stage.inputs, 'srm_check': 'srm_check'},
+                          stage.outputs, stage.concurrent)
+        stages.append(stage)
+    return Pipeline(stages, max_workers=pipeline.max_workers, profiler=pipeline.profiler)
+
+# In[ ]:
+
+
+# The two exports: per-day and overall allocation of impressions and reach
+srm_monitor = SRMMonitor().update(campaign_aggregates)
+display(srm_monitor.overall())
+daily_srm = srm_monitor.report().dropna(subset=['date'])
+print(daily_srm.groupby('column')['status'].value_counts().unstack(fill_value=0))
+
+# A new test-only day lands: it is added to the table and reported as a missing control day
+srm_monitor.update(frame_sufficient_stats(test_group.iloc[[-1]].assign(Date='31.08.2019'), metrics=()))
+print(srm_monitor.report().dropna(subset=['date']).tail(2)[['date', 'column', 'control', 'test', 'status']])
+
+# Guarded pipeline: 'warn' finishes with a warning, 'halt' stops before the power and bootstrap stages
+guarded_pipeline = with_srm_guard(build_analysis_pipeline())
+with warnings.catch_warnings(record=True) as caught:
+    warnings.simplefilter('always', SampleRatioMismatchWarning)
+    guarded_pipeline.run(**pipeline_params, srm_policy='warn', srm_alpha=0.001)
+    plt.close('all')
+srm_warnings = [str(w.message) for w in caught if issubclass(w.category, SampleRatioMismatchWarning)]
+print('warn:', len(guarded_pipeline.last_run), 'stages ran;', srm_warnings[0] if srm_warnings else 'no warning')
+
+halted_pipeline = with_srm_guard(build_analysis_pipeline())
+try:
+    halted_pipeline.run(**pipeline_params, srm_policy='halt', srm_alpha=0.001)
+except SampleRatioMismatchError as error:
+    print('halt:', sorted(halted_pipeline.last_run), '->', str(error)[:60], '...')
+
+# Vectorized over a portfolio: 5,000 campaigns x 30 days, ten of them with a broken 55/45 split
+rng_srm = analysis_streams.stream('srm_portfolio_demo')
+n_campaigns, days = 5000, pd.date_range('2019-08-01', periods=30)
+daily_traffic = rng_srm.poisson(50_000, size=(n_campaigns, len(days)))
+shares = np.where(np.arange(n_campaigns) < 10, 0.55, 0.5)[:, None]
+control_impressions = rng_srm.binomial(daily_traffic, shares)
+portfolio_counts = np.stack([control_impressions, daily_traffic - control_impressions], axis=1)  # (campaigns, variant, days)
+portfolio_aggregates = pd.DataFrame(
+    {'sum # of Impressions': portfolio_counts.ravel(), 'sum Reach': (0.8 * portfolio_counts).round().ravel()},
+    index=pd.MultiIndex.from_product([[f'Campaign {i}' for i in range(n_campaigns)], list(VARIANTS), days],
+                                     names=AGGREGATE_KEYS))
+start = time.perf_counter()
+portfolio_srm = SRMMonitor().update(portfolio_aggregates)
+portfolio_flags = portfolio_srm.overall().query("status == 'SRM' and column == '# of Impressions'")
+print(f'{len(portfolio_srm.report()):,} SRM tests in {time.perf_counter() - start:.2f} s;',
+      'flagged:', sorted(portfolio_flags['campaign'], key=lambda name: int(name.split()[1])))
+
+# - **The two exports fail the SRM check by a wide margin.** On the 29 days both arms reported, the control campaign received about 60% of impressions and 63% of reach. Every day is flagged for impressions and 27 of 29 for reach. The campaigns were evidently run with separate budgets and delivery, not as a randomized 50/50 split. Their rate metrics (CTR, CR, cost per result) can still be compared, but differences in who each campaign reached are confounded with the creative under test. Conclusions above should be read as a comparison of two campaigns, not a clean causal estimate.
+# - The guarded pipeline therefore defaults to `srm_policy='warn'`. The run completes, and the mismatch is reported with the control share and p-value. With `'halt'`, only the load, clean, metrics, tests and effect-size stages run, and no power or bootstrap time is spent.
+# - In the synthetic portfolio the ten campaigns with a 55/45 split are all flagged. The five other flags are the false positives expected at `alpha = 0.001` over 5,000 campaigns. All 310,000 daily and overall tests are evaluated in about a second.